@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""Scripted session replay benchmark for the interactive loop.
+
+Replays keystroke scripts (bench/scripts/*.txt by default: one input line per
+line, '#' lines are comments) through run_session() against the real
+extensions, with run_command(), run_http() and run_sqlite() replaced by stubs
+that print a few canned lines. What's left is the dispatch path: menu lookup, display,
+help/about, prompt collection and inline parsing.
+
+Lines are handed over by a Session subclass the moment the menu code asks
+for one, in place of the stdin reader thread, so a run is deterministic
+and the timings contain no I/O waits. For every input it records the time
+from receiving the line to asking for the next one; per script it also
+records the total CPU time of the session. Results are JSON percentiles in
+milliseconds.
+
+    python3 bench/replay.py --repeat 200 --output replay.json
+    python3 bench/replay.py bench/scripts/kiwix_inline.txt --per-input
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import bpqx_core  # noqa: E402
+
+
+class ReplaySession(bpqx_core.Session):
+    """A session whose input is a fixed list of lines and whose output is counted, not shown."""
+
+    def __init__(self, lines):
+        super().__init__()
+        self.script = list(lines)
+        self.position = 0
+        self.output_bytes = 0
+        self.timings = []
+        self.last = None
+
+    def write(self, text):
+        self.output_bytes += len(text)
+
+    async def read_line(self):
+        now = time.perf_counter()
+        if self.watching:
+            # The pager (or another prompt inside a command) wants an answer; keep going.
+            return ""
+        if self.last is not None:
+            self.timings.append((self.script[self.position - 1], now - self.last))
+        if self.position == len(self.script):
+            return None
+        line = self.script[self.position]
+        self.position += 1
+        self.last = time.perf_counter()
+        return line
+
+
+def is_pipe(fd):
+    """True for a pipe fd from run_pipeline(), False for None or subprocess.DEVNULL."""
+    return isinstance(fd, int) and fd >= 0
+
+
+def drain(fd):
+    with open(fd, "rb") as f:
+        while f.read(65536):
+            pass
+
+
+def install_stubs(lines):
+    """Replace command, HTTP and sqlite execution with canned output of `lines` lines."""
+    async def run_command(out, command, stdin=None, stdout=None):
+        # Like the real run_command(), take ownership of pipeline fds: read
+        # the previous step to the end and send output on instead of to out.
+        loop = asyncio.get_running_loop()
+        if is_pipe(stdin):
+            await loop.run_in_executor(None, drain, stdin)
+        if is_pipe(stdout):
+            data = "".join(f"{command} [{n}]\n" for n in range(lines)).encode()
+            try:
+                await loop.run_in_executor(None, bpqx_core.write_all, stdout, data)
+            finally:
+                os.close(stdout)
+            return True
+        for n in range(lines):
+            await out.write(f"{command} [{n}]\n")
+        await out.finish()
+        return True
+
+    async def run_http(out, request, timeout=None):
+        for n in range(lines):
+            await out.write(f"{request['method']} {request['url']} [{n}]\n")
+        await out.finish()
+        return True
+
+    async def run_sqlite(out, query):
+        for n in range(lines):
+            await out.write(f"{os.path.basename(query['database'])} {query['params']} [{n}]\n")
+        await out.finish()
+        return True
+
+    bpqx_core.run_command = run_command
+    bpqx_core.run_http = run_http
+    bpqx_core.run_sqlite = run_sqlite
+
+
+def read_script(path):
+    with open(path) as f:
+        return [line.rstrip("\r\n") for line in f if not line.startswith("#")]
+
+
+def summarize(samples):
+    """Percentiles of a list of seconds, in milliseconds (nearest rank)."""
+    ordered = sorted(samples)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))] * 1000
+
+    return {
+        "n": len(ordered),
+        "min": round(ordered[0] * 1000, 4),
+        "p50": round(rank(50), 4),
+        "p90": round(rank(90), 4),
+        "p99": round(rank(99), 4),
+        "max": round(ordered[-1] * 1000, 4),
+    }
+
+
+async def replay(lines, appsettings, registry):
+    session = ReplaySession(lines)
+    start = time.process_time()
+    await bpqx_core.run_session(session, appsettings, registry)
+    return session, time.process_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay keystroke scripts through the BPQX menus")
+    parser.add_argument("scripts", nargs="*",
+                        help="script files (default bench/scripts/*.txt)")
+    parser.add_argument("--repeat", type=int, default=100, help="replays per script (default 100)")
+    parser.add_argument("--stub-lines", type=int, default=5,
+                        help="lines of output each stubbed command prints (default 5)")
+    parser.add_argument("--per-input", action="store_true",
+                        help="also report percentiles for each input line")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    scripts = args.scripts or sorted(glob.glob(os.path.join(BENCH_DIR, "scripts", "*.txt")))
+    install_stubs(args.stub_lines)
+    # Keep persisted responses out of the real cache file.
+    bpqx_core.RESPONSE_CACHE_PATH = os.path.join(tempfile.mkdtemp(prefix="bpqx-replay-"), ".bpqx-responses")
+
+    cache = bpqx_core.LoadCache()
+    appsettings = bpqx_core.load_appsettings(cache)
+    registry = bpqx_core.ExtensionRegistry(cache, appsettings)
+    # Load every body up front so the first replay doesn't pay for it.
+    for ext in registry.extensions.values():
+        bpqx_core.load_extension_body(ext, registry.menu_width)
+
+    report = {"python": sys.version.split()[0], "stub_lines": args.stub_lines, "results": []}
+    for path in scripts:
+        lines = read_script(path)
+        dispatch, cpu, per_input = [], [], {}
+        output_bytes = 0
+        for _ in range(max(1, args.repeat)):
+            # Start every replay with empty response caches, as a fresh process would.
+            bpqx_core.RESPONSE_CACHES.clear()
+            bpqx_core.PERSISTED_SCOPES.clear()
+            if os.path.exists(bpqx_core.RESPONSE_CACHE_PATH):
+                os.unlink(bpqx_core.RESPONSE_CACHE_PATH)
+            session, seconds = asyncio.run(replay(lines, appsettings, registry))
+            cpu.append(seconds)
+            output_bytes = session.output_bytes
+            for n, (line, elapsed) in enumerate(session.timings):
+                dispatch.append(elapsed)
+                per_input.setdefault((n, line), []).append(elapsed)
+        record = {
+            "script": os.path.basename(path),
+            "inputs": len(lines),
+            "output_bytes": output_bytes,
+            "dispatch": summarize(dispatch),
+            "session_cpu": summarize(cpu),
+        }
+        if args.per_input:
+            record["per_input"] = [dict(summarize(samples), input=line)
+                                   for (_, line), samples in sorted(per_input.items())]
+        report["results"].append(record)
+        print(f"{record['script']}: dispatch p50 {record['dispatch']['p50']} ms, "
+              f"p99 {record['dispatch']['p99']} ms; session CPU p50 {record['session_cpu']['p50']} ms",
+              file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""Startup latency benchmark for bpqx.py.
+
+Generates synthetic extension sets of different sizes and menu shapes in a
+scratch directory, then times:
+
+  validate_extension   validating one already-parsed extension
+  parse_extension      full parse, validate and compile of one extension file
+  load_extensions      loading every header with a cold and a warm load cache
+  first_prompt         exec of bpqx.py to the first "Select Extension:" prompt,
+                       with and without caches on disk
+
+Results go to stdout (or --output) as JSON: one record per size and shape
+with min/p50/p90/p99/max in milliseconds. Needs PyYAML to generate files.
+
+    python3 bench/startup.py --sizes 10,100,1000 --repeat 5 --output startup.json
+"""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import bpqx_core  # noqa: E402
+
+# name -> (menu depth, items per menu)
+SHAPES = {
+    "wide": (1, 20),
+    "deep": (6, 2),
+    "mixed": (3, 6),
+}
+
+# Single-key shortcuts that don't clash with the reserved A/B/H/X.
+KEYS = "CDEFGIJKLMNOPQRSTUVWYZ"
+
+
+def make_io(path):
+    return {
+        "help": f"Run {path}",
+        "prompts": [{
+            "prompt": "Enter a value",
+            "inputs": [{"id": 1, "type": "string", "required": True, "name": "value"}],
+        }],
+        "command": f"echo {path} {{value}}",
+    }
+
+
+def make_menu(depth, width, path):
+    items = []
+    for i in range(width):
+        item = {"id": i + 1, "text": f"Item{path}{i}", "help": f"Item {i} of {path or 'root'}"}
+        if i < len(KEYS):
+            item["key"] = KEYS[i]
+        if depth > 1:
+            item["menu"] = make_menu(depth - 1, width, f"{path}{i}")
+        else:
+            item["io"] = make_io(f"{path}{i}")
+        items.append(item)
+    return {"prompt": f"Select from {path or 'root'}", "items": items}
+
+
+def generate(directory, count, depth, width):
+    """Write appsettings.yml, a copy of bpqx.py and bpqx_core.py and `count` extensions into directory."""
+    import yaml
+
+    ext_dir = os.path.join(directory, "extensions")
+    os.makedirs(ext_dir)
+    for name in ("bpqx.py", "bpqx_core.py"):
+        shutil.copy(os.path.join(REPO_DIR, name), directory)
+    shutil.copy(os.path.join(REPO_DIR, "appsettings.yml"), directory)
+    menu = make_menu(depth, width, "")
+    for n in range(count):
+        data = {
+            "name": f"Ext{n:04d}",
+            "description": f"Synthetic extension {n}",
+            "about": "Generated by bench/startup.py",
+            "help": "Nothing to see here",
+            "program": {"start_msg": "", "menu": menu},
+        }
+        with open(os.path.join(ext_dir, f"ext{n:04d}.yml"), "w") as f:
+            yaml.safe_dump(data, f, sort_keys=False)
+
+
+def clear_caches(directory):
+    for name in (".bpqx-cache", ".bpqx-cache.d"):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.unlink(path)
+
+
+def summarize(samples):
+    """Percentiles of a list of seconds, in milliseconds (nearest rank)."""
+    ordered = sorted(samples)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))] * 1000
+
+    return {
+        "n": len(ordered),
+        "min": round(ordered[0] * 1000, 3),
+        "p50": round(rank(50), 3),
+        "p90": round(rank(90), 3),
+        "p99": round(rank(99), 3),
+        "max": round(ordered[-1] * 1000, 3),
+    }
+
+
+def time_first_prompt(directory):
+    """Seconds from starting bpqx.py until it prints the first extension list."""
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, os.path.join(directory, "bpqx.py")],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=directory)
+    seen = b""
+    while b"Select Extension:" not in seen:
+        chunk = os.read(proc.stdout.fileno(), 65536)
+        if not chunk:
+            raise RuntimeError(f"bpqx.py exited before the first prompt: {seen[-200:]!r}")
+        seen += chunk
+    elapsed = time.perf_counter() - start
+    proc.communicate(b"x\n")
+    return elapsed
+
+
+def bench_set(directory, repeat):
+    ext_dir = os.path.join(directory, "extensions")
+    files = sorted(glob.glob(os.path.join(ext_dir, "*.yml")))
+    results = {}
+    bpqx_core.EXTENSIONS_DIR = ext_dir
+    bpqx_core.BODY_CACHE_DIR = os.path.join(directory, ".bpqx-cache.d")
+
+    # One file is representative: they all share a shape.
+    data = bpqx_core.read_yaml(files[0])
+    results["validate_extension"] = summarize(
+        [timed(bpqx_core.validate_extension, data, files[0]) for _ in range(max(repeat, 20))])
+    results["parse_extension"] = summarize(
+        [timed(bpqx_core.parse_extension, files[0], 80) for _ in range(max(repeat, 20))])
+
+    cache_path = os.path.join(directory, ".bpqx-cache")
+    cold, warm = [], []
+    for _ in range(repeat):
+        clear_caches(directory)
+        cache = bpqx_core.LoadCache(cache_path)
+        cold.append(timed(bpqx_core.load_extensions, cache))
+        cache.save()
+        cache = bpqx_core.LoadCache(cache_path)
+        warm.append(timed(bpqx_core.load_extensions, cache))
+    results["load_extensions_cold"] = summarize(cold)
+    results["load_extensions_warm"] = summarize(warm)
+
+    cold, warm = [], []
+    for _ in range(repeat):
+        clear_caches(directory)
+        cold.append(time_first_prompt(directory))
+        warm.append(time_first_prompt(directory))
+    results["first_prompt_cold"] = summarize(cold)
+    results["first_prompt_warm"] = summarize(warm)
+    return results
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time bpqx.py startup against synthetic extension sets")
+    parser.add_argument("--sizes", default="10,100,1000",
+                        help="comma-separated extension counts (default 10,100,1000)")
+    parser.add_argument("--shapes", default=",".join(SHAPES),
+                        help=f"comma-separated menu shapes from {', '.join(SHAPES)} (default all)")
+    parser.add_argument("--repeat", type=int, default=5, help="samples per measurement (default 5)")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = {"python": sys.version.split()[0], "results": []}
+    for shape in args.shapes.split(","):
+        depth, width = SHAPES[shape]
+        for size in (int(s) for s in args.sizes.split(",")):
+            directory = tempfile.mkdtemp(prefix="bpqx-bench-")
+            try:
+                generate(directory, size, depth, width)
+                record = {"extensions": size, "shape": shape, "depth": depth, "width": width}
+                record.update(bench_set(directory, max(1, args.repeat)))
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+            report["results"].append(record)
+            print(f"{shape} x{size}: first prompt p50 "
+                  f"{record['first_prompt_cold']['p50']} ms cold, "
+                  f"{record['first_prompt_warm']['p50']} ms warm", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
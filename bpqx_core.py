@@ -0,0 +1,3366 @@
+"""BPQX: menu-driven extensions over line-based text I/O. Run it with bpqx.py."""
+
+import bisect
+import codecs
+import collections
+import contextlib
+import glob
+import functools
+import hashlib
+import importlib.util
+import itertools
+import marshal
+import math
+import os
+import re
+import shlex
+import signal
+import struct
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+
+
+def lazy_import(name):
+    """Return module name, executed on its first attribute access rather than now.
+
+    This is the LazyLoader recipe from the importlib docs, for modules that
+    cost a noticeable part of start-up but aren't needed to show the menu.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+# Importing asyncio takes longer than everything else start-up does.
+asyncio = lazy_import("asyncio")
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+EXTENSIONS_DIR = os.path.join(SCRIPT_DIR, "extensions")
+APPSETTINGS_PATH = os.path.join(SCRIPT_DIR, "appsettings.yml")
+CACHE_PATH = os.path.join(SCRIPT_DIR, ".bpqx-cache")
+# Compiled extension bodies, one file per extension content hash and menu width.
+BODY_CACHE_DIR = os.path.join(SCRIPT_DIR, ".bpqx-cache.d")
+RESPONSE_CACHE_PATH = os.path.join(SCRIPT_DIR, ".bpqx-responses")
+# Where --pool listens by default; bpqx_launch.py uses the same path.
+POOL_SOCKET_PATH = os.path.join(SCRIPT_DIR, ".bpqx-pool.sock")
+
+# Bump when the layout of cached entries changes.  marshal output is only
+# readable by the Python version that wrote it, so that is part of the key too.
+CACHE_VERSION = 18
+CACHE_KEY = (CACHE_VERSION, tuple(sys.version_info[:2]))
+
+# Bytes read from a command's stdout at a time.
+COMMAND_CHUNK_SIZE = 4096
+
+# Longest line held back for paging and the line filters; a longer one is sent on in pieces.
+OUTPUT_LINE_LIMIT = 64 * 1024
+
+# Bytes of a command's stderr kept (the most recent) for the trace.
+STDERR_TAIL_BYTES = 2048
+
+# Queued in place of a line when the user presses Ctrl-C.
+INTERRUPT = "\x03"
+
+# Bytes read from an HTTP response per executor call.
+HTTP_CHUNK_SIZE = 4096
+
+# Rows fetched from a sqlite query per executor call.
+SQLITE_FETCH_ROWS = 200
+
+# Mean radius of the Earth, for the distance functions given to sqlite queries.
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_MILE = 1.609344
+MILES_PER_DEGREE = EARTH_RADIUS_KM / KM_PER_MILE * math.pi / 180
+
+# Output longer than this is shown but never stored in a response cache.
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024
+RESPONSE_CACHE_DEFAULT_ENTRIES = 100
+
+# Integer settings of an output block; 0 turns each one off.
+OUTPUT_LIMITS = {"page_lines", "page_bytes", "max_bytes", "wrap"}
+
+# Upper bounds of the metrics histogram buckets: seconds for timings, bytes for output size.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = (100, 1000, 4000, 16000, 64000, 256000, 1000000)
+# Recent samples per histogram that admin percentiles are taken from.
+METRICS_WINDOW = 500
+# Seconds between rewrites of the --metrics-file.
+METRICS_FILE_INTERVAL = 15
+# A sample line of Metrics.prometheus(): metric, item label, le bound (histogram buckets only), value.
+PROMETHEUS_SAMPLE = re.compile(r'(bpqx_\w+)\{item="((?:[^"\\]|\\.)*)"(?:,le="([^"]*)")?\} (\S+)$')
+
+# A {placeholder} in a command, http or sqlite field; the group is its id or name.
+# Only letters, digits, _ and . may appear between the braces, and a $ before
+# one makes it shell syntax, so JSON bodies, ${HOME} and awk '{print $1}'
+# are left as they are.
+PLACEHOLDER = re.compile(r"(?<!\$)\{([\w.]+)\}")
+
+# Parts of a parallel io block run at once unless it sets parallel_limit.
+PARALLEL_DEFAULT_LIMIT = 4
+
+# Characters that mean a command needs /bin/sh: operators, redirection,
+# subshells, globs and (outside single quotes) expansions.
+SHELL_SYNTAX = set("|&;<>()$`*?[")
+
+# A {a,b} or {1..3} brace expansion; find's {} and a {placeholder} aren't one.
+BRACE_EXPANSION = re.compile(r"\{[^\s{}]*(?:,|\.\.)[^\s{}]*\}")
+
+# A leading NAME=value word, which sh treats as an environment setting for the command.
+ENV_ASSIGNMENT = re.compile(r"\s*([A-Za-z_][A-Za-z0-9_]*=)")
+
+# What opens and closes each kind of SQL string, quoted identifier and comment.
+SQL_QUOTES = (("'", "'"), ('"', '"'), ("`", "`"), ("[", "]"), ("--", "\n"), ("/*", "*/"))
+
+HTTP_METHODS = {"GET", "POST", "PUT", "PATCH", "DELETE", "HEAD"}
+
+# Maidenhead locator pairs: (letters, degrees of longitude, degrees of latitude) per step.
+MAIDENHEAD_PAIRS = (
+    ("ABCDEFGHIJKLMNOPQR", 20.0, 10.0),     # field
+    ("0123456789", 2.0, 1.0),               # square
+    ("ABCDEFGHIJKLMNOPQRSTUVWX", 5 / 60, 2.5 / 60),  # subsquare
+)
+# Per pair: ({char: longitude offset}, {char: latitude offset}, width, height).
+MAIDENHEAD_TABLES = [
+    ({c: i * lng for i, c in enumerate(chars)}, {c: i * lat for i, c in enumerate(chars)}, lng, lat)
+    for chars, lng, lat in MAIDENHEAD_PAIRS
+]
+# Placeholders a grid input adds, as {name.field}: its centre and bounding box in degrees.
+GRID_FIELDS = ("lat", "lng", "south", "north", "west", "east")
+
+# Canonical forms of input values (see INPUT_TYPES): decimal places kept for
+# coordinates (about 10 m) and for frequencies in MHz (1 Hz).
+COORDINATE_PLACES = 4
+FREQUENCY_PLACES = 6
+BOOL_WORDS = {"true": "true", "yes": "true", "y": "true", "1": "true",
+              "false": "false", "no": "false", "n": "false", "0": "false"}
+# Prefix, digit, suffix, with an optional portable prefix or suffix: W1AW, 2E0ABC, VE3/W1AW, W1AW/P.
+CALLSIGN = re.compile(r"(?:[A-Z0-9]{1,4}/)?[A-Z0-9]{1,3}[0-9][A-Z0-9]{0,3}[A-Z](?:/[A-Z0-9]{1,4})?")
+FREQUENCY = re.compile(r"(\d+(?:\.\d*)?|\.\d+)\s*([kmg]?hz)?", re.IGNORECASE)
+FREQUENCY_MHZ = {None: 1.0, "hz": 1e-6, "khz": 1e-3, "mhz": 1.0, "ghz": 1e3}
+DATE_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%Y%m%d", "%m/%d/%Y")
+# Input types that take min and max, and the ones that take places.
+RANGED_TYPES = {"int", "float", "frequency"}
+
+# Fields of an io block (or pipeline step, or parallel part) naming what it runs.
+ACTION_FIELDS = ("command", "http", "sqlite")
+
+# Extension fields read at startup; the program tree is loaded on first launch.
+EXTENSION_HEADER_FIELDS = ("name", "description", "about", "help", "version")
+
+RESERVED_KEYS = {"a", "b", "h", "x"}
+RESERVED_TEXTS = {"about", "back", "help", "exit"}
+
+
+class LoadCache:
+    """Parsed and validated YAML files, keyed by path and stamped with mtime, size and hash.
+
+    A file is only re-parsed when its mtime or size changed and its sha256 no
+    longer matches, so a warm start never needs to import PyYAML. For
+    extensions this holds only the header; compiled bodies live in
+    BODY_CACHE_DIR and are read on first launch (see load_extension_body()).
+    """
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self.files = {}
+        self.seen = set()
+        self.dirty = False
+        try:
+            with open(path, "rb") as f:
+                data = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return
+        if isinstance(data, dict) and data.get("key") == CACHE_KEY:
+            self.files = data.get("files") or {}
+
+    def get(self, filepath, parse):
+        """Return the cached result of parse(filepath), calling it only if the file changed."""
+        self.seen.add(filepath)
+        st = os.stat(filepath)
+        stamp = (st.st_mtime_ns, st.st_size)
+        entry = self.files.get(filepath)
+        if entry and entry["stamp"] == stamp:
+            return entry["result"]
+        with open(filepath, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        if not entry or entry["digest"] != digest:
+            entry = {"digest": digest, "result": parse(filepath)}
+        entry["stamp"] = stamp
+        self.files[filepath] = entry
+        self.dirty = True
+        return entry["result"]
+
+    def digest(self, filepath):
+        return self.files[filepath]["digest"]
+
+    def save(self):
+        """Write the cache back if anything changed, dropping entries for files that are gone."""
+        stale = set(self.files) - self.seen
+        if not self.dirty and not stale:
+            return
+        for filepath in stale:
+            del self.files[filepath]
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                marshal.dump({"key": CACHE_KEY, "files": self.files}, f)
+            os.replace(tmp, self.path)
+        except (OSError, ValueError):
+            # Unwritable directory or a YAML value marshal can't store; run uncached.
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+        self.dirty = False
+        # Drop compiled bodies of files that have since changed or gone away.
+        digests = {entry["digest"] for entry in self.files.values()}
+        try:
+            names = os.listdir(BODY_CACHE_DIR)
+        except OSError:
+            return
+        for name in names:
+            if name.split("-", 1)[0] not in digests:
+                try:
+                    os.unlink(os.path.join(BODY_CACHE_DIR, name))
+                except OSError:
+                    pass
+
+
+def read_yaml(filepath):
+    with open(filepath, "r") as f:
+        return load_yaml_text(f.read())
+
+
+def load_yaml_text(text):
+    import yaml
+
+    return yaml.safe_load(text)
+
+
+def load_appsettings(cache):
+    return cache.get(APPSETTINGS_PATH, read_yaml)
+
+
+def parse_inline_param(s):
+    """Extract base and parameter name from strings like 'S {search}' -> ('s', 'search')."""
+    m = re.match(r'^(\S+)\s+\{(\w+)\}$', s)
+    if m:
+        return m.group(1).lower(), m.group(2)
+    return s.lower(), None
+
+
+def strip_inline_param(s):
+    """Remove '{param}' suffix from key/text for display."""
+    return re.sub(r'\s*\{\w+\}$', '', s)
+
+
+def validate_io(io_obj, filepath, path):
+    errors = []
+    if isinstance(io_obj, list):
+        if len(io_obj) == 0:
+            errors.append(f"{filepath}: {path}.io must not be empty")
+            return errors
+        if len(io_obj) > 1:
+            return validate_pipeline(io_obj, filepath, path)
+        io_obj = io_obj[0]
+    if not isinstance(io_obj, dict):
+        errors.append(f"{filepath}: {path}.io must be a mapping")
+        return errors
+    if sum(field in io_obj for field in ACTION_FIELDS + ("parallel",)) != 1:
+        errors.append(f"{filepath}: {path}.io must have exactly one of 'command', 'http', 'sqlite' or 'parallel'")
+    if "parallel" in io_obj:
+        parts = io_obj["parallel"]
+        if not isinstance(parts, list) or not parts:
+            errors.append(f"{filepath}: {path}.io.parallel must be a non-empty list")
+        else:
+            for k, part in enumerate(parts):
+                part_path = f"{path}.io.parallel[{k}]"
+                if not isinstance(part, dict):
+                    errors.append(f"{filepath}: {part_path} must be a mapping")
+                    continue
+                if sum(field in part for field in ACTION_FIELDS) != 1:
+                    errors.append(f"{filepath}: {part_path} must have exactly one of 'command', 'http' or 'sqlite'")
+                if "title" in part and not isinstance(part["title"], str):
+                    errors.append(f"{filepath}: {part_path}.title must be a string")
+                errors.extend(validate_action(part, filepath, part_path))
+        limit = io_obj.get("parallel_limit", PARALLEL_DEFAULT_LIMIT)
+        if isinstance(limit, bool) or not isinstance(limit, int) or limit < 1:
+            errors.append(f"{filepath}: {path}.io.parallel_limit must be a positive integer")
+    else:
+        errors.extend(validate_action(io_obj, filepath, f"{path}.io"))
+    errors.extend(validate_io_settings(io_obj, filepath, f"{path}.io"))
+    known = set()
+    errors.extend(validate_prompts(io_obj.get("prompts"), filepath, f"{path}.io", known))
+    unknown = sorted(set(io_placeholders(io_obj)) - known)
+    if unknown:
+        errors.append(f"{filepath}: {path}.io uses placeholder(s) no input provides: "
+                      f"{', '.join('{' + name + '}' for name in unknown)}")
+    return errors
+
+
+def validate_io_settings(io_obj, filepath, path):
+    """Check the timeout, cache and output settings of an io block (the first step of a pipeline)."""
+    errors = []
+    if "cache" in io_obj:
+        errors.extend(validate_cache(io_obj["cache"], filepath, f"{path}.cache"))
+    if "output" in io_obj:
+        errors.extend(validate_output(io_obj["output"], filepath, f"{path}.output"))
+    timeout = io_obj.get("timeout")
+    if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0):
+        errors.append(f"{filepath}: {path}.timeout must be a positive number of seconds")
+    return errors
+
+
+def validate_prompts(prompts, filepath, path, known):
+    """Check an io block's prompts, adding the id and name of every input to the set known."""
+    errors = []
+    if not prompts:
+        return errors
+    if not isinstance(prompts, list):
+        errors.append(f"{filepath}: {path}.prompts must be a list")
+        return errors
+    for j, p in enumerate(prompts):
+        p_path = f"{path}.prompts[{j}]"
+        if not isinstance(p, dict):
+            errors.append(f"{filepath}: {p_path} must be a mapping")
+            continue
+        if "prompt" not in p:
+            errors.append(f"{filepath}: {p_path}.prompt is required")
+        inputs = p.get("inputs")
+        if inputs:
+            if not isinstance(inputs, list):
+                errors.append(f"{filepath}: {p_path}.inputs must be a list")
+            else:
+                for k, inp in enumerate(inputs):
+                    if "id" not in inp:
+                        errors.append(f"{filepath}: {p_path}.inputs[].id is required")
+                    if "type" not in inp:
+                        errors.append(f"{filepath}: {p_path}.inputs[].type is required")
+                    else:
+                        errors.extend(validate_input(inp, filepath, f"{p_path}.inputs[{k}]"))
+                    keys = [str(inp.get("id"))] + ([str(inp["name"])] if inp.get("name") else [])
+                    known.update(keys)
+                    fields, _ = INPUT_FIELDS.get(str(inp.get("type", "")).lower(), ((), None))
+                    known.update(f"{key}.{field}" for key in keys for field in fields)
+    return errors
+
+
+def validate_input(inp, filepath, path):
+    """Check an input's type and the options that type takes (see INPUT_TYPES).
+
+    An unknown type (text, str, ...) is taken as string, as it was before
+    types were checked, with a warning on stderr rather than an error.
+    """
+    errors = []
+    t = str(inp["type"]).lower()
+    if t not in INPUT_TYPES:
+        print(f"Warning: {filepath}: {path}.type {inp['type']!r} is not one of {', '.join(INPUT_TYPES)}; "
+              f"treating it as string", file=sys.stderr)
+        t = "string"
+    if t == "enum":
+        choices = inp.get("choices")
+        if not isinstance(choices, list) or not choices or not all(isinstance(c, (str, int)) for c in choices):
+            errors.append(f"{filepath}: {path}.choices must be a non-empty list of values for an enum input")
+    elif "choices" in inp:
+        errors.append(f"{filepath}: {path}.choices only applies to an enum input")
+    if t == "regex":
+        try:
+            re.compile(inp.get("pattern"))
+        except (re.error, TypeError) as e:
+            errors.append(f"{filepath}: {path}.pattern must be a regular expression for a regex input: {e}")
+    elif "pattern" in inp:
+        errors.append(f"{filepath}: {path}.pattern only applies to a regex input")
+    for field in ("min", "max"):
+        if field not in inp:
+            continue
+        if t not in RANGED_TYPES:
+            errors.append(f"{filepath}: {path}.{field} only applies to {', '.join(sorted(RANGED_TYPES))} inputs")
+        elif isinstance(inp[field], bool) or not isinstance(inp[field], (int, float)):
+            errors.append(f"{filepath}: {path}.{field} must be a number")
+    if "places" in inp:
+        places = inp["places"]
+        if t != "float":
+            errors.append(f"{filepath}: {path}.places only applies to a float input")
+        elif isinstance(places, bool) or not isinstance(places, int) or places < 0:
+            errors.append(f"{filepath}: {path}.places must be a non-negative integer")
+    return errors
+
+
+def validate_pipeline(steps, filepath, path):
+    """Check a list-form io block, whose entries are the steps of a pipeline (see run_pipeline())."""
+    errors = []
+    known = set()
+    for k, step in enumerate(steps):
+        if not isinstance(step, dict):
+            errors.append(f"{filepath}: {path}.io[{k}] must be a mapping")
+            return errors
+        # Every step's prompts are asked before the pipeline starts, so any step may use any input.
+        errors.extend(validate_prompts(step.get("prompts"), filepath, f"{path}.io[{k}]", known))
+    captured = set()
+    for k, step in enumerate(steps):
+        step_path = f"{path}.io[{k}]"
+        if sum(field in step for field in ACTION_FIELDS) != 1:
+            errors.append(f"{filepath}: {step_path} must have exactly one of 'command', 'http' or 'sqlite'")
+        errors.extend(validate_action(step, filepath, step_path))
+        if k == 0:
+            errors.extend(validate_io_settings(step, filepath, step_path))
+        else:
+            for field in ("timeout", "cache", "output"):
+                if field in step:
+                    errors.append(f"{filepath}: {step_path}.{field} belongs on the first step, "
+                                  f"which holds the settings of the whole pipeline")
+        pipe = step.get("pipe", False)
+        if not isinstance(pipe, bool):
+            errors.append(f"{filepath}: {step_path}.pipe must be true or false")
+        elif pipe and k == 0:
+            errors.append(f"{filepath}: {step_path}.pipe needs a step before it")
+        elif pipe and "sqlite" in step:
+            errors.append(f"{filepath}: {step_path}.pipe can't feed a sqlite query")
+        elif pipe and steps[k - 1].get("capture"):
+            errors.append(f"{filepath}: {step_path}.pipe can't read step {k - 1}, whose output is captured")
+        elif pipe and isinstance(step.get("http"), dict) and "body" in step["http"]:
+            errors.append(f"{filepath}: {step_path}.http.body can't be set on a piped step; it sends what it reads")
+        unknown = sorted(set(io_placeholders(step)) - known - captured)
+        if unknown:
+            errors.append(f"{filepath}: {step_path} uses placeholder(s) no input or earlier capture provides: "
+                          f"{', '.join('{' + name + '}' for name in unknown)}")
+        capture = step.get("capture")
+        if capture is None:
+            continue
+        if not isinstance(capture, str) or not re.fullmatch(r"\w+", capture):
+            errors.append(f"{filepath}: {step_path}.capture must be a placeholder name (letters, digits, _)")
+        elif capture in known or capture in captured:
+            errors.append(f"{filepath}: {step_path}.capture '{capture}' is already an input or capture name")
+        else:
+            captured.add(capture)
+    return errors
+
+
+def io_placeholders(io_obj):
+    """Names of every placeholder in an io block's command or http fields, including parallel parts."""
+    texts = []
+    parts = io_obj.get("parallel")
+    for action in parts if isinstance(parts, list) else [io_obj]:
+        if not isinstance(action, dict):
+            continue
+        if isinstance(action.get("command"), str):
+            texts.append(action["command"])
+        http = action.get("http")
+        if isinstance(http, dict):
+            texts.extend([str(http.get("url", "")), str(http.get("body") or "")])
+            for field in ("query", "headers"):
+                if isinstance(http.get(field), dict):
+                    texts.extend(str(v) for v in http[field].values())
+        sqlite = action.get("sqlite")
+        if isinstance(sqlite, dict):
+            # row placeholders name result columns, not inputs.
+            texts.extend(str(sqlite.get(field) or "") for field in ("query", "header", "empty"))
+    return [name for text in texts for name in PLACEHOLDER.findall(text)]
+
+
+def validate_action(action, filepath, path):
+    """Check the command (and shell flag), http or sqlite block of an io block, step or parallel part."""
+    errors = []
+    if "http" in action:
+        errors.extend(validate_http(action["http"], filepath, f"{path}.http"))
+    if "sqlite" in action:
+        errors.extend(validate_sqlite(action["sqlite"], filepath, f"{path}.sqlite"))
+    shell = action.get("shell", False)
+    if not isinstance(shell, bool):
+        errors.append(f"{filepath}: {path}.shell must be true or false")
+    elif shell and "command" not in action:
+        errors.append(f"{filepath}: {path}.shell only applies to a command")
+    elif "command" in action and not shell:
+        command = action["command"]
+        if not isinstance(command, str):
+            errors.append(f"{filepath}: {path}.command must be a string")
+        else:
+            syntax = find_shell_syntax(command)
+            if syntax:
+                errors.append(f"{filepath}: {path}.command uses shell syntax ({syntax!r}); "
+                              f"quote it or set shell: true")
+            else:
+                try:
+                    shlex.split(command)
+                except ValueError as e:
+                    errors.append(f"{filepath}: {path}.command can't be split into arguments: {e}")
+    return errors
+
+
+def find_shell_syntax(command):
+    """The first unquoted shell syntax in command (a character, or a NAME= prefix), or None.
+
+    Besides operators and expansions this covers what sh reads differently
+    from a plain argument list: a line break between commands (or a
+    backslash continuing a line), a # starting a comment, and a leading
+    NAME=value setting. A trailing line break, as a YAML block scalar
+    leaves, is ignored.
+    """
+    m = ENV_ASSIGNMENT.match(command)
+    if m:
+        return m.group(1)
+    quote = None
+    escaped = False
+    for i, ch in enumerate(command):
+        if escaped:
+            escaped = False
+            if ch == "\n":
+                return "\\\n"
+        elif quote == "'":
+            if ch == "'":
+                quote = None
+        elif ch == "\\":
+            escaped = True
+        elif quote == '"':
+            if ch == '"':
+                quote = None
+            elif ch in "$`":
+                return ch
+        elif ch in "'\"":
+            quote = ch
+        elif ch in SHELL_SYNTAX:
+            return ch
+        elif ch == "\n" and command[i:].strip():
+            return ch
+        elif ch in "~#" and (i == 0 or command[i - 1].isspace()):
+            return ch
+        elif ch == "{" and BRACE_EXPANSION.match(command, i):
+            return ch
+    return None
+
+
+def validate_http(http, filepath, path):
+    import urllib.parse
+
+    errors = []
+    if not isinstance(http, dict):
+        errors.append(f"{filepath}: {path} must be a mapping")
+        return errors
+    url = http.get("url")
+    if not isinstance(url, str):
+        errors.append(f"{filepath}: {path}.url is required")
+    elif urllib.parse.urlsplit(url).scheme not in ("http", "https"):
+        errors.append(f"{filepath}: {path}.url must be an http:// or https:// URL")
+    method = http.get("method", "GET")
+    if not isinstance(method, str) or method.upper() not in HTTP_METHODS:
+        errors.append(f"{filepath}: {path}.method must be one of {', '.join(sorted(HTTP_METHODS))}")
+    for field in ("query", "headers"):
+        if field in http and not isinstance(http[field], dict):
+            errors.append(f"{filepath}: {path}.{field} must be a mapping")
+    if "body" in http and not isinstance(http["body"], str):
+        errors.append(f"{filepath}: {path}.body must be a string")
+    return errors
+
+
+def validate_sqlite(sqlite, filepath, path):
+    errors = []
+    if not isinstance(sqlite, dict):
+        errors.append(f"{filepath}: {path} must be a mapping")
+        return errors
+    for field in ("database", "query"):
+        if not isinstance(sqlite.get(field), str) or not sqlite[field].strip():
+            errors.append(f"{filepath}: {path}.{field} is required")
+    quoted = find_quoted_placeholder(sqlite.get("query") or "")
+    if quoted:
+        errors.append(f"{filepath}: {path}.query has a placeholder inside quotes or a comment ({quoted}); "
+                      f"placeholders are bound as values, so leave them unquoted (LIKE '%' || {{q}} || '%')")
+    for field in ("row", "header", "empty"):
+        if field in sqlite and not isinstance(sqlite[field], str):
+            errors.append(f"{filepath}: {path}.{field} must be a string")
+    return errors
+
+
+def find_quoted_placeholder(query):
+    """The first placeholder inside a string, quoted identifier or comment of an SQL query, or None.
+
+    There it would become a literal ? (or none at all) instead of a bound
+    parameter. A doubled '' inside a string closes and reopens it, which
+    leaves the scan inside the string as it should.
+    """
+    end = None
+    i = 0
+    while i < len(query):
+        if end is None:
+            for start, stop in SQL_QUOTES:
+                if query.startswith(start, i):
+                    end = stop
+                    i += len(start)
+                    break
+            else:
+                i += 1
+        elif query.startswith(end, i):
+            i += len(end)
+            end = None
+        else:
+            m = PLACEHOLDER.match(query, i)
+            if m:
+                return m.group(0)
+            i += 1
+    return None
+
+
+def validate_cache(cache, filepath, path):
+    errors = []
+    if not isinstance(cache, dict):
+        errors.append(f"{filepath}: {path} must be a mapping")
+        return errors
+    ttl = cache.get("ttl")
+    if isinstance(ttl, bool) or not isinstance(ttl, (int, float)) or ttl <= 0:
+        errors.append(f"{filepath}: {path}.ttl is required and must be a positive number of seconds")
+    max_entries = cache.get("max_entries", RESPONSE_CACHE_DEFAULT_ENTRIES)
+    if isinstance(max_entries, bool) or not isinstance(max_entries, int) or max_entries <= 0:
+        errors.append(f"{filepath}: {path}.max_entries must be a positive integer")
+    if not isinstance(cache.get("persist", False), bool):
+        errors.append(f"{filepath}: {path}.persist must be true or false")
+    return errors
+
+
+def validate_output(output, filepath, path):
+    errors = []
+    if not isinstance(output, dict):
+        errors.append(f"{filepath}: {path} must be a mapping")
+        return errors
+    for field, value in output.items():
+        if field == "collapse_whitespace":
+            if not isinstance(value, bool):
+                errors.append(f"{filepath}: {path}.{field} must be true or false")
+        elif field in OUTPUT_LIMITS:
+            if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+                errors.append(f"{filepath}: {path}.{field} must be a non-negative integer")
+        else:
+            errors.append(f"{filepath}: {path}.{field} is not a known output setting")
+    return errors
+
+
+def validate_menu(menu, filepath, path="program.menu"):
+    errors = []
+    if not isinstance(menu, dict):
+        errors.append(f"{filepath}: {path} must be a mapping")
+        return errors
+    if "prompt" not in menu:
+        errors.append(f"{filepath}: {path}.prompt is required")
+    if "items" not in menu or not isinstance(menu.get("items"), list):
+        errors.append(f"{filepath}: {path}.items is required and must be a list")
+        return errors
+    for i, item in enumerate(menu["items"]):
+        item_path = f"{path}.items[{i}]"
+        if "id" not in item:
+            errors.append(f"{filepath}: {item_path}.id is required")
+        if "text" not in item:
+            errors.append(f"{filepath}: {item_path}.text is required")
+        if "help" not in item:
+            errors.append(f"{filepath}: {item_path}.help is required")
+        key = item.get("key")
+        key_base, key_param = parse_inline_param(key) if key else (None, None)
+        if key_base and key_base in RESERVED_KEYS:
+            errors.append(f"{filepath}: {item_path}.key '{key}' is reserved")
+        text = item.get("text")
+        _, text_param = parse_inline_param(text) if text else (None, None)
+        if text and strip_inline_param(text).lower() in RESERVED_TEXTS:
+            errors.append(f"{filepath}: {item_path}.text '{text}' is reserved")
+        inline_param = key_param or text_param
+        if inline_param:
+            if "menu" in item:
+                errors.append(f"{filepath}: {item_path} inline parameter '{inline_param}' is only valid with 'io', not 'menu'")
+            if "io" in item:
+                io = item["io"]
+                all_inputs = []
+                for step in io if isinstance(io, list) else [io]:
+                    if isinstance(step, dict):
+                        for p in (step.get("prompts") or []):
+                            all_inputs.extend(p.get("inputs") or [])
+                if len(all_inputs) != 1:
+                    errors.append(f"{filepath}: {item_path} inline parameter requires exactly 1 input, found {len(all_inputs)}")
+                elif not any(inp.get("name") == inline_param for inp in all_inputs):
+                    errors.append(f"{filepath}: {item_path} inline parameter '{inline_param}' does not match input name '{all_inputs[0].get('name', '')}'")
+        has_io = "io" in item
+        has_menu = "menu" in item
+        if has_io == has_menu:
+            errors.append(f"{filepath}: {item_path} must have exactly one of 'io' or 'menu'")
+        if has_io:
+            errors.extend(validate_io(item["io"], filepath, item_path))
+        if has_menu:
+            errors.extend(validate_menu(item["menu"], filepath, f"{item_path}.menu"))
+    return errors
+
+
+def validate_extension(data, filepath):
+    errors = []
+    for field in ("name", "description", "program"):
+        if field not in data:
+            errors.append(f"{filepath}: '{field}' is required")
+    if "program" in data:
+        prog = data["program"]
+        if not isinstance(prog, dict):
+            errors.append(f"{filepath}: 'program' must be a mapping")
+        elif "menu" not in prog:
+            errors.append(f"{filepath}: 'program.menu' is required")
+        else:
+            errors.extend(validate_menu(prog["menu"], filepath))
+    return errors
+
+
+def parse_extension(filepath, menu_width=0):
+    """Parse, validate and compile one extension file. Returns {'data': ..., 'errors': [...]}."""
+    try:
+        data = read_yaml(filepath)
+    except Exception as e:
+        return {"data": None, "errors": [f"Error parsing {filepath}: {e}"]}
+    if not isinstance(data, dict):
+        return {"data": None, "errors": [f"Error in {filepath}: file must contain a YAML mapping"]}
+    errors = validate_extension(data, filepath)
+    if errors:
+        return {"data": None, "errors": errors}
+    compile_extension(data, menu_width)
+    return {"data": data, "errors": []}
+
+
+def parse_extension_header(filepath):
+    """Parse only the top-level fields of an extension file, skipping the program tree.
+
+    The program block is everything from a top-level "program:" line up to
+    the next top-level key, so the rest can be loaded without building the
+    whole menu tree. A file with no such line (a quoted key, or a flow
+    mapping) is loaded whole. Returns {'data': ..., 'errors': [...]} like
+    parse_extension().
+    """
+    kept = []
+    in_program = has_program = False
+    try:
+        with open(filepath, "r") as f:
+            for line in f:
+                if line[:1] not in ("", " ", "\t", "\r", "\n", "#"):
+                    in_program = re.match(r"program\s*:", line) is not None
+                    has_program = has_program or in_program
+                if not in_program:
+                    kept.append(line)
+        data = load_yaml_text("".join(kept))
+    except Exception as e:
+        return {"data": None, "errors": [f"Error parsing {filepath}: {e}"]}
+    if not isinstance(data, dict):
+        return {"data": None, "errors": [f"Error in {filepath}: file must contain a YAML mapping"]}
+    errors = [f"{filepath}: '{field}' is required" for field in ("name", "description") if field not in data]
+    # Without a "program:" line nothing was cut, so data is the whole file.
+    if not has_program and "program" not in data:
+        errors.append(f"{filepath}: 'program' is required")
+    if errors:
+        return {"data": None, "errors": errors}
+    header = {field: data[field] for field in EXTENSION_HEADER_FIELDS if field in data}
+    return {"data": header, "errors": []}
+
+
+def load_extensions(cache):
+    """Load the header of every extension; bodies are loaded on first launch."""
+    extensions = {}
+    for filepath in sorted(glob.glob(os.path.join(EXTENSIONS_DIR, "*.yml"))):
+        result = cache.get(filepath, parse_extension_header)
+        if result["errors"]:
+            for err in result["errors"]:
+                print(err)
+            continue
+        ext = dict(result["data"], _file=filepath, _digest=cache.digest(filepath))
+        extensions[ext["name"].lower()] = ext
+    return extensions
+
+
+class ExtensionRegistry:
+    """The live set of extensions, which a server reloads file by file as they change.
+
+    reload() never modifies self.extensions in place: it builds a new dict and
+    swaps it in, so a session that is inside an extension keeps the menu tree
+    it started with and sees the new one when it returns to the main menu.
+    """
+
+    def __init__(self, cache, appsettings):
+        self.cache = cache
+        self.menu_width = appsettings.get("menu_width") or 0
+        self.extensions = load_extensions(cache)
+
+    def reload(self, filepath):
+        """Re-read one extension file, or drop it if it is gone. A broken edit keeps the old version."""
+        extensions = {key: ext for key, ext in self.extensions.items() if ext["_file"] != filepath}
+        if os.path.exists(filepath):
+            # This runs in a server's watcher task, so nothing a bad file can
+            # raise may escape: a validator tripping over an unexpected type
+            # (text: Yes is a bool) is reported like any other error.
+            try:
+                result = self.cache.get(filepath, parse_extension_header)
+                errors = result["errors"]
+                if not errors:
+                    ext = dict(result["data"], _file=filepath, _digest=self.cache.digest(filepath))
+                    # Validate the whole program now rather than on first launch,
+                    # so a bad edit never replaces a working extension.
+                    errors = load_extension_body(ext, self.menu_width)
+                    if not errors and ext["name"].lower() in extensions:
+                        errors = [f"{filepath}: extension name '{ext['name']}' is already in use"]
+            except OSError as e:
+                errors = [f"Error reading {filepath}: {e}"]
+            except Exception as e:
+                errors = [f"Error in {filepath}: {type(e).__name__}: {e}"]
+            if errors:
+                for err in errors:
+                    print(err)
+                if len(extensions) < len(self.extensions):
+                    print(f"Kept the previous version of {filepath}")
+                return
+            extensions[ext["name"].lower()] = ext
+            print(f"Reloaded {ext['name']} from {filepath}")
+        elif len(extensions) < len(self.extensions):
+            self.cache.seen.discard(filepath)
+            print(f"Removed extensions from {filepath}")
+        else:
+            return
+        self.extensions = dict(sorted(extensions.items(), key=lambda item: item[1]["_file"]))
+        self.cache.save()
+
+
+def load_extension_body(ext, menu_width=0):
+    """Fill in ext["program"] the first time the extension is launched. Returns a list of errors.
+
+    The compiled body is cached in BODY_CACHE_DIR under the file's hash, so
+    only the first launch after a change parses and validates it.
+    """
+    if "program" in ext:
+        return []
+    path = os.path.join(BODY_CACHE_DIR, f"{ext['_digest']}-{menu_width}")
+    result = None
+    try:
+        with open(path, "rb") as f:
+            cached = marshal.load(f)
+        if isinstance(cached, dict) and cached.get("key") == CACHE_KEY:
+            result = cached["result"]
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    if result is None:
+        try:
+            with open(ext["_file"], "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+        except OSError:
+            digest = None
+        result = parse_extension(ext["_file"], menu_width)
+        # If the file changed since its header was read, the body doesn't
+        # belong under the old hash; use it for this launch only.
+        if digest == ext["_digest"]:
+            tmp = f"{path}.{os.getpid()}.tmp"
+            try:
+                os.makedirs(BODY_CACHE_DIR, exist_ok=True)
+                with open(tmp, "wb") as f:
+                    marshal.dump({"key": CACHE_KEY, "result": result}, f)
+                os.replace(tmp, path)
+            except (OSError, ValueError):
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+    if result["errors"]:
+        return result["errors"]
+    ext["program"] = result["data"]["program"]
+    return []
+
+
+def compile_menu(menu, menu_width=0):
+    """Build menu["_index"], the lookup tables find_item_by_input() and find_item_by_text() use.
+
+    "base" maps the lowercased key or text without its inline parameter to
+    [item position, check order, inline parameter name] entries; "exact"
+    maps the full lowercased key or text to [item position, check order].
+    Check order (key 0, text 1, full key 2, full text 3) reproduces which
+    rule wins when several items could match. "text" maps display text to
+    the first item with it, and "prefix" is a trie over the text bases
+    whose values are [item position, inline parameter name]. menu["_display"]
+    is the menu line as shown, wrapped to menu_width. Everything is plain
+    data so it can be cached.
+    """
+    base, exact, texts, prefixes = {}, {}, {}, []
+    for i, item in enumerate(menu["items"]):
+        key = item.get("key", "")
+        text = item["text"]
+        if key:
+            key_base, key_param = parse_inline_param(key)
+            base.setdefault(key_base, []).append([i, 0, key_param])
+            exact.setdefault(key.lower(), []).append([i, 2])
+        text_base, text_param = parse_inline_param(text)
+        base.setdefault(text_base, []).append([i, 1, text_param])
+        prefixes.append((text_base, [i, text_param]))
+        exact.setdefault(text.lower(), []).append([i, 3])
+        texts.setdefault(strip_inline_param(text).lower(), i)
+        if "menu" in item:
+            compile_menu(item["menu"], menu_width)
+        elif "io" in item:
+            compile_io(item["io"])
+    menu["_index"] = {"base": base, "exact": exact, "text": texts, "prefix": build_trie(prefixes)}
+    menu["_display"] = render_menu(menu, menu_width)
+
+
+def compile_io(io_obj):
+    """Compile an io block's command or request into templates (see compile_template()).
+
+    A command that doesn't need a shell becomes io["_argv"], one template per
+    argument, run without /bin/sh; a shell command becomes io["_command"].
+    An http block becomes io["_http"] (see compile_http()) and a sqlite
+    block io["_sqlite"] (see compile_sqlite()). Each part of a parallel
+    block or step of a pipeline is compiled the same way. Inputs are
+    compiled by compile_input().
+    """
+    for io in io_obj if isinstance(io_obj, list) else [io_obj]:
+        for prompt in io.get("prompts") or []:
+            for inp in prompt.get("inputs") or []:
+                compile_input(inp)
+        for action in io.get("parallel") or [io]:
+            if "http" in action:
+                action["_http"] = compile_http(action["http"])
+            elif "sqlite" in action:
+                action["_sqlite"] = compile_sqlite(action["sqlite"])
+            elif action.get("shell"):
+                action["_command"] = compile_template(action["command"])
+            else:
+                action["_argv"] = [compile_template(arg) for arg in shlex.split(action["command"])]
+
+
+def compile_input(inp):
+    """Resolve an input's type to its INPUT_TYPES key in inp["_type"], and an enum's choices to a lookup table."""
+    inp["_type"] = str(inp["type"]).lower()
+    if inp["_type"] not in INPUT_TYPES:
+        inp["_type"] = "string"  # see validate_input()
+    if inp["_type"] == "enum":
+        inp["_choices"] = {str(c).lower(): str(c) for c in inp["choices"]}
+
+
+def build_trie(entries):
+    """Prefix trie over (word, value) pairs.
+
+    Each node is [children, values], where children maps the next character
+    to a node and values lists the value of every word under that prefix in
+    insertion order, so a lookup costs one step per character typed.
+    """
+    root = [{}, []]
+    for word, value in entries:
+        node = root
+        node[1].append(value)
+        for ch in word:
+            node = node[0].setdefault(ch, [{}, []])
+            node[1].append(value)
+    return root
+
+
+def trie_lookup(trie, prefix):
+    """Values of every word in the trie that starts with prefix."""
+    node = trie
+    for ch in prefix:
+        node = node[0].get(ch)
+        if node is None:
+            return []
+    return node[1]
+
+
+def compile_extension(data, menu_width=0):
+    compile_menu(data["program"]["menu"], menu_width)
+
+
+def render_menu(menu, width=0):
+    """The menu's prompt line, e.g. "Action: [S]Search (search) [G]Get (UID)".
+
+    With a width, the line is broken between items so no line is longer
+    than width (unless a single item is); continuation lines are indented.
+    """
+    parts = []
+    for item in sorted(menu["items"], key=lambda x: x["id"]):
+        raw_key = item.get("key", "")
+        raw_text = item.get("text", "")
+        key_base = strip_inline_param(raw_key) if raw_key else None
+        text_base = strip_inline_param(raw_text)
+        _, key_param = parse_inline_param(raw_key) if raw_key else (None, None)
+        _, text_param = parse_inline_param(raw_text)
+        param = key_param or text_param
+        suffix = f" ({param})" if param else ""
+        if key_base:
+            parts.append(f"[{key_base}]{text_base}{suffix}")
+        else:
+            parts.append(f"{text_base}{suffix}")
+    line = f"{menu['prompt']}:"
+    if not width:
+        return f"\n{line} {' '.join(parts)}"
+    lines = []
+    for part in parts:
+        if len(line) + 1 + len(part) > width:
+            lines.append(line)
+            line = "  " + part
+        else:
+            line += " " + part
+    lines.append(line)
+    return "\n" + "\n".join(lines)
+
+
+def find_item_by_input(menu, user_input):
+    """Match user input to a menu item. Returns (item, inline_value) tuple."""
+    index = menu["_index"]
+    parts = user_input.split(None, 1)
+    base_lower = parts[0].lower() if parts else user_input.lower()
+    inline_value = None
+    if len(parts) == 2:
+        try:
+            parsed = shlex.split(parts[1])
+            inline_value = parsed[0] if len(parsed) == 1 else parts[1]
+        except ValueError:
+            inline_value = parts[1]
+
+    best = None
+    for i, order, param in index["base"].get(base_lower, ()):
+        # A bare key or text matches; with a value after it, only if the item takes one.
+        if param and inline_value:
+            match = (i, order, (param, inline_value))
+        elif not inline_value:
+            match = (i, order, None)
+        else:
+            continue
+        if best is None or match[:2] < best[:2]:
+            best = match
+    for i, order in index["exact"].get(user_input.lower(), ()):
+        if best is None or (i, order) < best[:2]:
+            best = (i, order, None)
+    if best is None:
+        # Fall back to an unambiguous prefix of an item's text, e.g. "Wik" for "Wikipedia".
+        matches = find_items_by_prefix(menu, base_lower, inline_value)
+        if len(matches) != 1:
+            return None, None
+        i, param = matches[0]
+        return menu["items"][i], (param, inline_value) if inline_value else None
+    return menu["items"][best[0]], best[2]
+
+
+def find_items_by_prefix(menu, prefix, inline_value=None):
+    """[item position, inline parameter] of items whose text starts with prefix.
+
+    With an inline value, only items that take one are candidates.
+    """
+    matches = trie_lookup(menu["_index"]["prefix"], prefix)
+    if inline_value:
+        matches = [m for m in matches if m[1]]
+    return matches
+
+
+def find_item_by_text(menu, text):
+    i = menu["_index"]["text"].get(text.lower())
+    return None if i is None else menu["items"][i]
+
+
+class TraceWriter:
+    """Appends trace records to a JSON-lines file from a background thread.
+
+    write() only queues the record, so tracing never makes a user wait on the
+    disk. Each batch of queued records goes out in one append, which keeps
+    lines from several processes sharing the file whole.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pid = None
+        self.queue = None
+        self.thread = None
+
+    def write(self, record):
+        if self.pid != os.getpid():
+            # First record in this process (a forked pool worker starts without the thread).
+            import queue
+
+            self.pid = os.getpid()
+            self.queue = queue.SimpleQueue()
+            self.thread = threading.Thread(target=self._run, args=(self.queue,), daemon=True)
+            self.thread.start()
+        self.queue.put(record)
+
+    def _run(self, records):
+        import json
+
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        except OSError as e:
+            print(f"Error opening trace file {self.path}: {e}", file=sys.stderr)
+            return
+        try:
+            done = False
+            while not done:
+                batch = [records.get()]
+                while not records.empty():
+                    batch.append(records.get_nowait())
+                if None in batch:
+                    done = True
+                    batch = [r for r in batch if r is not None]
+                data = "".join(json.dumps(r, default=str) + "\n" for r in batch).encode()
+                try:
+                    os.write(fd, data)
+                except OSError:
+                    pass
+        finally:
+            os.close(fd)
+
+    def close(self):
+        """Write out everything queued so far."""
+        if self.thread is not None and self.pid == os.getpid():
+            self.queue.put(None)
+            self.thread.join(timeout=5)
+            self.pid = None
+
+
+# Set from appsettings trace_file by start_trace().
+TRACE = None
+
+
+def start_trace(appsettings):
+    global TRACE
+    if appsettings.get("trace_file"):
+        TRACE = TraceWriter(os.path.join(SCRIPT_DIR, appsettings["trace_file"]))
+
+
+def stop_trace():
+    if TRACE is not None:
+        TRACE.close()
+
+
+class SessionExit(Exception):
+    """Raised to end a session: the user typed X/Exit or the connection closed."""
+
+
+class Session:
+    """Line-based I/O for one connected user.
+
+    Incoming lines are queued by a reader (a thread for stdin, a task for
+    sockets) so the menu code only ever awaits input() and calls print().
+    A None in the queue marks end of input; INTERRUPT marks a Ctrl-C.
+    """
+
+    newline = "\n"
+    ids = itertools.count(1)
+
+    def __init__(self):
+        self.id = f"{os.getpid()}.{next(Session.ids)}"
+        self.lines = asyncio.Queue(maxsize=64)
+        # Lines typed while a command was running, replayed before the queue.
+        self.pending = collections.deque()
+        self.callsign = None
+        self.appsettings = {}
+        # While a command runs, wait_for_abort() owns the queue and passes lines to reply.
+        self.watching = False
+        self.reply = None
+        # Seconds spent waiting at the pager, which command timeouts don't count.
+        self.paused = 0.0
+        self.paused_since = None
+
+    def write(self, text):
+        raise NotImplementedError
+
+    def trace(self, event, **fields):
+        """Add an event for this session to the trace file, if tracing is on."""
+        if TRACE is not None:
+            TRACE.write(dict(ts=round(time.time(), 3), session=self.id, event=event, **fields))
+
+    def print(self, *args, end="\n"):
+        text = " ".join(str(a) for a in args) + end
+        if self.newline != "\n":
+            text = text.replace("\r\n", "\n").replace("\n", self.newline)
+        self.write(text)
+
+    async def read_line(self):
+        """Next raw line: a string, INTERRUPT, or None at end of input."""
+        if self.watching:
+            self.reply = asyncio.get_running_loop().create_future()
+            try:
+                return await self.reply
+            finally:
+                self.reply = None
+        return self.pending.popleft() if self.pending else await self.lines.get()
+
+    async def input(self, prompt=""):
+        if prompt:
+            self.write(prompt)
+        await self.drain()
+        line = await self.read_line()
+        if line is None:
+            self.pending.appendleft(None)
+            raise SessionExit
+        if line == INTERRUPT:
+            return ""
+        return line
+
+    def paused_time(self):
+        if self.paused_since is None:
+            return self.paused
+        return self.paused + time.monotonic() - self.paused_since
+
+    def interrupt(self):
+        try:
+            self.lines.put_nowait(INTERRUPT)
+        except asyncio.QueueFull:
+            pass
+
+    def interrupts(self):
+        """Context manager that routes Ctrl-C to interrupt() while a command runs."""
+        return contextlib.nullcontext()
+
+    async def drain(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class StdioSession(Session):
+    """Session on this process's stdin/stdout (one process per connection)."""
+
+    def __init__(self):
+        super().__init__()
+        loop = asyncio.get_running_loop()
+        # A daemon thread rather than an executor so a blocked read never holds up exit.
+        threading.Thread(target=self._read_stdin, args=(loop,), daemon=True).start()
+
+    def _read_stdin(self, loop):
+        import concurrent.futures
+
+        try:
+            for line in sys.stdin:
+                self._put(loop, line.rstrip("\r\n"))
+            self._put(loop, None)
+        except (RuntimeError, concurrent.futures.CancelledError):
+            # The session ended and its event loop closed while input was still arriving.
+            pass
+
+    def _put(self, loop, line):
+        put = self.lines.put(line)
+        try:
+            asyncio.run_coroutine_threadsafe(put, loop).result()
+        except RuntimeError:
+            put.close()  # never scheduled; don't leave it to warn when collected
+            raise
+
+    def write(self, text):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+    @contextlib.contextmanager
+    def interrupts(self):
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGINT, self.interrupt)
+        except (NotImplementedError, RuntimeError, ValueError):
+            yield
+            return
+        try:
+            yield
+        finally:
+            loop.remove_signal_handler(signal.SIGINT)
+
+
+class StreamSession(Session):
+    """Session on an asyncio stream (a TCP or Unix socket connection in server mode)."""
+
+    # BPQ and telnet clients both end lines with CR; accept CR, LF or CRLF on input.
+    newline = "\r\n"
+
+    def __init__(self, reader, writer):
+        super().__init__()
+        self.reader = reader
+        self.writer = writer
+        self.reader_task = asyncio.ensure_future(self._read_lines())
+
+    async def _read_lines(self):
+        buf = b""
+        skip_lf = False
+        try:
+            while True:
+                chunk = await self.reader.read(1024)
+                if not chunk:
+                    break
+                # Telnet "interrupt process" arrives as IAC IP; treat it like a raw Ctrl-C.
+                buf += chunk.replace(b"\xff\xf4", b"\x03")
+                while buf:
+                    if skip_lf and buf[:1] == b"\n":
+                        buf = buf[1:]
+                    skip_lf = False
+                    m = re.search(b"[\r\n\x03]", buf)
+                    if not m:
+                        break
+                    line, sep, buf = buf[:m.start()], buf[m.start():m.end()], buf[m.end():]
+                    skip_lf = sep == b"\r"
+                    if sep == b"\x03":
+                        self.interrupt()
+                    else:
+                        await self.lines.put(line.decode("utf-8", errors="replace"))
+        except (ConnectionError, OSError):
+            pass
+        if buf:
+            await self.lines.put(buf.decode("utf-8", errors="replace"))
+        await self.lines.put(None)
+
+    def write(self, text):
+        if not self.writer.is_closing():
+            self.writer.write(text.encode("utf-8", errors="replace"))
+
+    async def drain(self):
+        try:
+            await self.writer.drain()
+        except (ConnectionError, OSError):
+            pass
+
+    async def close(self):
+        self.reader_task.cancel()
+        await self.drain()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+
+async def run_io(session, io_obj, precollected=None, label=None):
+    """Collect an io block's inputs, then run its command, request or pipeline.
+
+    label names the item for metrics, as "Extension/Menu/Item".
+    """
+    if isinstance(io_obj, list) and len(io_obj) == 1:
+        io_obj = io_obj[0]
+    steps = io_obj if isinstance(io_obj, list) else [io_obj]
+    # A pipeline's settings live on its first step; its prompts are all asked up front.
+    block = steps[0]
+    prompts = [p for step in steps for p in sorted(step.get("prompts") or [], key=lambda p: p.get("id", 0))]
+    help_text = next((step["help"] for step in steps if step.get("help")), "No help available.")
+    collected = dict(precollected) if precollected else {}
+    waited = None
+    started = time.monotonic()
+
+    for prompt_def in prompts:
+        inputs_def = prompt_def.get("inputs", []) or []
+        inputs_sorted = sorted(inputs_def, key=lambda x: x["id"]) if inputs_def else []
+
+        if inputs_sorted and all(
+            (inp.get("name") and inp["name"] in collected) or str(inp["id"]) in collected
+            for inp in inputs_sorted
+        ):
+            # Given inline with the menu choice; check it like a typed answer.
+            preset = [collected[inp["name"]] if inp.get("name") in collected else collected[str(inp["id"])]
+                      for inp in inputs_sorted]
+            preset, errors = coerce_inputs(inputs_sorted, preset)
+            if not errors:
+                for inp, val in zip(inputs_sorted, preset):
+                    store_input(collected, inp, val)
+                continue
+            for error in errors:
+                session.print(f"Error: {error}")
+
+        while True:
+            waited = started
+            user_input = (await session.input(f"{prompt_def['prompt']}: ")).strip()
+
+            if user_input.lower() in ("h", "help"):
+                session.print(help_text)
+                continue
+
+            if not inputs_sorted:
+                break
+
+            try:
+                values = shlex.split(user_input) if user_input else []
+            except ValueError:
+                values = user_input.split() if user_input else []
+            if len(values) != len(inputs_sorted):
+                if not values:
+                    has_required = any(inp.get("required") for inp in inputs_sorted)
+                    if not has_required:
+                        for inp in inputs_sorted:
+                            store_input(collected, inp, "")
+                        break
+                    session.print("Error: input is required")
+                else:
+                    session.print(f"Error: expected {len(inputs_sorted)} input(s), got {len(values)}")
+                continue
+
+            values, errors = coerce_inputs(inputs_sorted, values)
+            for error in errors:
+                session.print(f"Error: {error}")
+            if errors:
+                continue
+
+            for inp, val in zip(inputs_sorted, values):
+                store_input(collected, inp, val)
+            break
+
+    if waited is not None:
+        METRICS.observe(label, "input_wait", time.monotonic() - waited)
+    values = {str(k): v for k, v in collected.items()}
+    if values:
+        session.trace("inputs", item=label, inputs=values)
+    timeout = block.get("timeout", session.appsettings.get("command_timeout"))
+    try:
+        if len(steps) > 1:
+            # Later steps depend on captures made at run time; the inputs decide the result.
+            cache_key = tuple(sorted(values.items()))
+
+            def run(out):
+                return run_pipeline(out, steps, values, timeout)
+        elif "parallel" in io_obj:
+            actions = [prepare_action(part, values, timeout) for part in io_obj["parallel"]]
+            titles = [part.get("title") for part in io_obj["parallel"]]
+            limit = io_obj.get("parallel_limit", PARALLEL_DEFAULT_LIMIT)
+            cache_key = tuple(key for _, key in actions)
+
+            def run(out):
+                return run_parallel(out, [work for work, _ in actions], titles, limit)
+        else:
+            run, cache_key = prepare_action(io_obj, values, timeout)
+    except KeyError as e:
+        # validate_io() checks names against the prompts, so this is an input that wasn't asked for.
+        session.print(f"Error: no value for placeholder {{{e.args[0]}}}")
+        return
+
+    settings = output_settings(session.appsettings, block)
+    cache = response_cache_for(io_obj)
+    if cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            METRICS.count(label, "cache_hits")
+            session.trace("command", item=label, cached=True, bytes=len(cached.encode("utf-8", errors="replace")))
+            out = CommandOutput(session, settings)
+            try:
+                await out.write(cached)
+                await out.finish()
+            except StopOutput:
+                pass
+            return
+    out = CommandOutput(session, settings, capture=RESPONSE_CACHE_MAX_BYTES if cache else 0)
+    paused = session.paused_time()
+    ok = await run_with_abort(session, run(out), timeout)
+    METRICS.observe_command(label, out, session.paused_time() - paused, ok)
+    kind = "pipeline" if len(steps) > 1 else next(f for f in ("parallel",) + ACTION_FIELDS if f in io_obj)
+    extra = {"stderr": out.stderr} if ok is False and out.stderr else {}
+    session.trace("command", item=label, kind=kind,
+                  duration=round(time.monotonic() - out.created, 3), status=out.status,
+                  result={True: "ok", False: "error", None: "aborted"}[ok], bytes=out.received, **extra)
+    if cache and ok and out.captured() is not None:
+        cache.put(cache_key, out.captured(), block["cache"]["ttl"])
+
+
+def coerce_inputs(inputs, values):
+    """Check values against their inputs' types (see INPUT_TYPES).
+
+    Returns (canonical values, error messages); the values are only
+    complete when there are no errors.
+    """
+    coerced, errors = [], []
+    for inp, val in zip(inputs, values):
+        if not val:
+            if inp.get("required"):
+                errors.append(f"input {inp['id']} is required")
+            coerced.append("")
+            continue
+        try:
+            coerced.append(INPUT_TYPES[inp["_type"]](val, inp))
+        except ValueError as e:
+            errors.append(f"input {inp['id']} {e}")
+    return coerced, errors
+
+
+def store_input(collected, inp, val):
+    """Record a coerced value under its input's id and name, with any fields its type adds (see INPUT_FIELDS)."""
+    keys = [inp["id"]] + ([inp["name"]] if inp.get("name") else [])
+    _, fields = INPUT_FIELDS.get(inp["_type"], ((), None))
+    extra = fields(val) if fields else {}
+    for key in keys:
+        collected[key] = val
+        for field, text in extra.items():
+            collected[f"{key}.{field}"] = text
+
+
+def format_number(value, places=None):
+    """value as text without trailing zeros, rounded to places decimals if given."""
+    text = f"{value:.{places}f}" if places is not None else repr(value)
+    if "." in text and "e" not in text:
+        text = text.rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+
+def parse_number(text, what):
+    try:
+        value = float(text)
+    except ValueError:
+        raise ValueError(f"must be {what}") from None
+    if not math.isfinite(value):
+        raise ValueError(f"must be {what}")
+    return value
+
+
+def check_range(value, inp):
+    if "min" in inp and value < inp["min"]:
+        raise ValueError(f"must be at least {inp['min']}")
+    if "max" in inp and value > inp["max"]:
+        raise ValueError(f"must be at most {inp['max']}")
+    return value
+
+
+def coerce_string(text, inp):
+    return text
+
+
+def coerce_int(text, inp):
+    try:
+        value = int(text)
+    except ValueError:
+        raise ValueError("must be an integer") from None
+    return str(check_range(value, inp))
+
+
+def coerce_float(text, inp):
+    return format_number(check_range(parse_number(text, "a number"), inp), inp.get("places"))
+
+
+def coerce_bool(text, inp):
+    value = BOOL_WORDS.get(text.lower())
+    if value is None:
+        raise ValueError("must be true or false")
+    return value
+
+
+def coerce_enum(text, inp):
+    value = inp["_choices"].get(text.lower())
+    if value is None:
+        raise ValueError(f"must be one of {', '.join(inp['_choices'].values())}")
+    return value
+
+
+def coerce_regex(text, inp):
+    # Compiled on first use rather than in compile_input(), since a compiled
+    # pattern can't be stored in the marshalled body cache.
+    pattern = inp.get("_regex")
+    if pattern is None:
+        pattern = inp["_regex"] = re.compile(inp["pattern"])
+    if not pattern.fullmatch(text):
+        raise ValueError("is not in the expected form")
+    return text
+
+
+def coerce_callsign(text, inp):
+    value = text.upper()
+    if not CALLSIGN.fullmatch(value):
+        raise ValueError("must be a call sign, like W1AW")
+    return value
+
+
+def coerce_degrees(text, limit, negative, positive, what):
+    """Decimal degrees, optionally ending in a hemisphere letter (41.7N, 72.7W), rounded to COORDINATE_PLACES."""
+    sign = 1
+    if text[-1:].upper() in (negative, positive):
+        # -41.7S could mean either hemisphere, so a sign and a letter together are refused.
+        if text.lstrip().startswith(("-", "+")):
+            raise ValueError(f"must be {what}, with a sign or {positive}/{negative} but not both")
+        sign = -1 if text[-1].upper() == negative else 1
+        text = text[:-1]
+    value = sign * parse_number(text, what)
+    if abs(value) > limit:
+        raise ValueError(f"must be {what}")
+    return format_number(value, COORDINATE_PLACES)
+
+
+def coerce_lat(text, inp):
+    return coerce_degrees(text, 90, "S", "N", "a latitude from -90 to 90")
+
+
+def coerce_long(text, inp):
+    return coerce_degrees(text, 180, "W", "E", "a longitude from -180 to 180")
+
+
+def coerce_grid(text, inp):
+    if maidenhead_box(text) is None:
+        raise ValueError("must be a 4 or 6 character grid square, like FN43 or FN43pb")
+    return text[:2].upper() + text[2:4] + text[4:].lower()
+
+
+def coerce_frequency(text, inp):
+    """A frequency in MHz, or with a Hz, kHz, MHz or GHz unit, as MHz."""
+    m = FREQUENCY.fullmatch(text)
+    if not m:
+        raise ValueError("must be a frequency in MHz, like 146.52 or 146520kHz")
+    mhz = float(m.group(1)) * FREQUENCY_MHZ[m.group(2).lower() if m.group(2) else None]
+    return format_number(check_range(mhz, inp), FREQUENCY_PLACES)
+
+
+def coerce_date(text, inp):
+    import datetime
+
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            pass
+    raise ValueError("must be a date, like 2024-06-01")
+
+
+def maidenhead_box(locator):
+    """(south, west, north, east) in degrees of a 4 or 6 character Maidenhead locator, or None if it isn't one."""
+    if len(locator) not in (4, 6):
+        return None
+    south, west = -90.0, -180.0
+    for k in range(0, len(locator), 2):
+        lng_offsets, lat_offsets, width, height = MAIDENHEAD_TABLES[k // 2]
+        try:
+            west += lng_offsets[locator[k].upper()]
+            south += lat_offsets[locator[k + 1].upper()]
+        except KeyError:
+            return None
+    return south, west, south + height, west + width
+
+
+def grid_fields(locator):
+    """The GRID_FIELDS of a locator as text, ready for placeholders; all blank for a blank locator."""
+    if not locator:
+        return dict.fromkeys(GRID_FIELDS, "")
+    south, west, north, east = maidenhead_box(locator)
+    numbers = {"lat": (south + north) / 2, "lng": (west + east) / 2,
+               "south": south, "north": north, "west": west, "east": east}
+    return {field: format_number(numbers[field], 5) for field in GRID_FIELDS}
+
+
+# Input types: name -> function(text, input) returning the value's canonical
+# text, or raising ValueError with the end of a message ("must be ...").
+INPUT_TYPES = {
+    "string": coerce_string,
+    "int": coerce_int,
+    "float": coerce_float,
+    "bool": coerce_bool,
+    "enum": coerce_enum,
+    "regex": coerce_regex,
+    "callsign": coerce_callsign,
+    "lat": coerce_lat,
+    "long": coerce_long,
+    "grid": coerce_grid,
+    "frequency": coerce_frequency,
+    "date": coerce_date,
+}
+
+# Types that add {name.field} placeholders: name -> (fields, function(canonical text) -> {field: text}).
+INPUT_FIELDS = {
+    "grid": (GRID_FIELDS, grid_fields),
+}
+
+
+def prepare_action(action, values, timeout=None):
+    """Fill in an io block's (or parallel part's) command or request.
+
+    Returns (run, cache_key), where run(out) is the coroutine that performs
+    it. Raises KeyError for a placeholder with no value.
+    """
+    filled = render_action(action, values)
+    if "_sqlite" in action:
+        key = (filled["database"], filled["sql"], tuple(filled["params"]))
+        return (lambda out: run_sqlite(out, filled)), key
+    if isinstance(filled, dict):
+        key = (filled["method"], filled["url"], tuple(sorted(filled["headers"].items())), filled["body"])
+        return (lambda out: run_http(out, filled, timeout)), key
+    return (lambda out: run_command(out, filled)), tuple(filled) if isinstance(filled, list) else filled
+
+
+def render_action(action, values):
+    """Fill in a compiled action: an http request or sqlite query dict, an argument list or a shell string."""
+    if "_http" in action:
+        return build_http_request(action["_http"], values)
+    if "_sqlite" in action:
+        return build_sqlite_query(action["_sqlite"], values)
+    if "_argv" in action:
+        # Each placeholder fills part of one argument, whatever the value contains.
+        return [render_template(arg, values) for arg in action["_argv"]]
+    return render_template(action["_command"], values)
+
+
+def compile_template(text):
+    """Split text into [literal, placeholder, literal, ..., literal] for render_template().
+
+    Odd positions hold placeholder ids or names, so "ls {1} -x" becomes
+    ["ls ", "1", " -x"] and text with no placeholders is a 1-item list.
+    """
+    return PLACEHOLDER.split(text)
+
+
+def render_template(template, values):
+    """Fill a compiled template in one pass. Raises KeyError for a placeholder with no value."""
+    if len(template) == 1:
+        return template[0]
+    parts = list(template)
+    for i in range(1, len(parts), 2):
+        parts[i] = values[parts[i]]
+    return "".join(parts)
+
+
+class StopOutput(Exception):
+    """Raised by CommandOutput.write when no more output is wanted (pager quit or max_bytes reached)."""
+
+
+class CommandOutput:
+    """Where a running command's output goes: the session, plus an optional bounded copy.
+
+    settings is the merged output block (see output_settings()); it turns on
+    paging and the line filters. capture is the most characters to keep for
+    the response cache; output longer than that is still shown but not kept.
+    """
+
+    def __init__(self, session, settings=None, capture=0):
+        settings = settings or {}
+        self.session = session
+        self.capture = capture
+        self.parts = []
+        self.size = 0
+        self.page_lines = settings.get("page_lines", 0)
+        self.page_bytes = settings.get("page_bytes", 0)
+        self.max_bytes = settings.get("max_bytes", 0)
+        self.wrap = settings.get("wrap", 0)
+        self.collapse = settings.get("collapse_whitespace", False)
+        self.by_line = bool(self.page_lines or self.page_bytes or self.max_bytes or self.wrap or self.collapse)
+        self.partial = ""
+        self.last_text = "\n"
+        self.last_blank = False
+        self.lines_on_page = 0
+        self.bytes_on_page = 0
+        self.bytes_sent = 0
+        # For metrics: when the command was started and running, and its first output.
+        self.created = time.monotonic()
+        self.started = None
+        self.first_output = None
+        self.received = 0
+        # Exit code of the command or HTTP status of the response, once known
+        # (a list of them for a parallel block).
+        self.status = None
+        # The end of a command's stderr (see run_command()).
+        self.stderr = ""
+
+    async def write(self, text):
+        if not text:
+            return
+        if self.first_output is None:
+            self.first_output = time.monotonic()
+        self.received += len(text.encode("utf-8", errors="replace"))
+        if self.capture and self.size <= self.capture:
+            self.size += len(text)
+            self.parts.append(text)
+        if not self.by_line:
+            self.session.print(text, end="")
+            await self.session.drain()
+            return
+        *lines, self.partial = (self.partial + text).split("\n")
+        for line in lines:
+            await self.emit_line(line)
+        if len(self.partial) > OUTPUT_LINE_LIMIT:
+            line, self.partial = self.partial, ""
+            await self.emit_line(line, end="")
+
+    async def finish(self):
+        """Send any final line that had no trailing newline."""
+        if self.partial:
+            line, self.partial = self.partial, ""
+            await self.emit_line(line, end="")
+
+    async def emit_line(self, line, end="\n"):
+        if self.collapse:
+            line = " ".join(line.split())
+            if not line and self.last_blank:
+                return
+            self.last_blank = not line
+        pieces = [line]
+        if self.wrap and len(line) > self.wrap:
+            pieces = textwrap.wrap(line, self.wrap, break_on_hyphens=False) or [""]
+        for i, piece in enumerate(pieces):
+            await self.emit(piece + (end if i == len(pieces) - 1 else "\n"))
+
+    async def emit(self, text):
+        size = len(text.encode("utf-8", errors="replace"))
+        if self.max_bytes and self.bytes_sent + size > self.max_bytes:
+            self.session.print(f"{self.newline_if_needed()}-- More output not shown ({self.max_bytes} byte limit) --")
+            raise StopOutput
+        if (self.page_lines and self.lines_on_page >= self.page_lines) or (
+            self.page_bytes and self.bytes_on_page and self.bytes_on_page + size > self.page_bytes
+        ):
+            await self.more()
+        self.session.print(text, end="")
+        await self.session.drain()
+        self.last_text = text
+        self.bytes_sent += size
+        self.bytes_on_page += size
+        self.lines_on_page += text.count("\n")
+
+    def newline_if_needed(self):
+        return "" if self.last_text.endswith("\n") else "\n"
+
+    async def more(self):
+        self.session.print("-- More: Enter to continue, Q to quit --", end="")
+        await self.session.drain()
+        self.session.paused_since = time.monotonic()
+        try:
+            reply = await self.session.read_line()
+        finally:
+            self.session.paused = self.session.paused_time()
+            self.session.paused_since = None
+        if reply is None:
+            self.session.pending.appendleft(None)
+            raise StopOutput
+        if reply == INTERRUPT or reply.strip().lower() in ("q", "quit", "x", "exit"):
+            raise StopOutput
+        self.lines_on_page = 0
+        self.bytes_on_page = 0
+
+    def captured(self):
+        """The full output, or None if capture was off or the output was too long."""
+        if not self.capture or self.size > self.capture:
+            return None
+        return "".join(self.parts)
+
+
+def output_settings(appsettings, io_obj):
+    """The output block from appsettings.yml with the io block's own output settings on top."""
+    settings = dict(appsettings.get("output") or {})
+    settings.update(io_obj.get("output") or {})
+    return settings
+
+
+class ResponseCache:
+    """LRU store of command output for one io block, with a per-entry expiry time."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, text = entry
+        if expires < time.time():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return text
+
+    def put(self, key, text, ttl):
+        self.entries[key] = (time.time() + ttl, text)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class Histogram:
+    """Bucket counts since startup (for export) plus the most recent samples (for percentiles)."""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = collections.deque(maxlen=METRICS_WINDOW)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def percentile(self, p):
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+class Metrics:
+    """Timings and output sizes of io commands, keyed by their "Extension/Menu/Item" label.
+
+    Histograms:
+      input_wait    time the user spent answering the item's prompts
+      start         until the subprocess was running or the HTTP response headers arrived
+      first_byte    until the first output arrived
+      command       whole run, less time spent waiting at the pager
+      output_bytes  size of the output
+    Counters: runs, failures (error, abort or timeout) and cache_hits.
+    """
+
+    HISTOGRAMS = {
+        "input_wait": LATENCY_BUCKETS,
+        "start": LATENCY_BUCKETS,
+        "first_byte": LATENCY_BUCKETS,
+        "command": LATENCY_BUCKETS,
+        "output_bytes": SIZE_BUCKETS,
+    }
+    COUNTERS = ("runs", "failures", "cache_hits")
+
+    def __init__(self):
+        self.items = {}
+
+    def item(self, label):
+        item = self.items.get(label)
+        if item is None:
+            item = self.items[label] = {
+                "histograms": {name: Histogram(bounds) for name, bounds in self.HISTOGRAMS.items()},
+                "counters": dict.fromkeys(self.COUNTERS, 0),
+            }
+        return item
+
+    def observe(self, label, name, value):
+        if label:
+            self.item(label)["histograms"][name].observe(value)
+
+    def count(self, label, name):
+        if label:
+            self.item(label)["counters"][name] += 1
+
+    def observe_command(self, label, out, paused, ok):
+        """Record one finished run from the timestamps its CommandOutput collected."""
+        if not label:
+            return
+        self.count(label, "runs")
+        if not ok:
+            self.count(label, "failures")
+        if out.started is not None:
+            self.observe(label, "start", out.started - out.created)
+        if out.first_output is not None:
+            self.observe(label, "first_byte", out.first_output - out.created)
+        self.observe(label, "command", time.monotonic() - out.created - paused)
+        self.observe(label, "output_bytes", out.received)
+
+    def report(self):
+        """Plain-text table of recent percentiles, slowest commands first (for the admin socket)."""
+        def ms(value):
+            return "-" if value is None else f"{value * 1000:.0f}"
+
+        rows = []
+        for label, item in self.items.items():
+            hist, counters = item["histograms"], item["counters"]
+            rows.append((hist["command"].percentile(90) or 0, [
+                label, counters["runs"], counters["failures"], counters["cache_hits"],
+                ms(hist["start"].percentile(50)), ms(hist["first_byte"].percentile(50)),
+                ms(hist["command"].percentile(50)), ms(hist["command"].percentile(90)),
+                ms(hist["command"].percentile(99)),
+                "-" if not hist["output_bytes"].count else
+                f"{hist['output_bytes'].sum / hist['output_bytes'].count:.0f}",
+            ]))
+        rows.sort(key=lambda row: row[0], reverse=True)
+        header = ["item", "runs", "fail", "hits", "start", "1st byte", "p50", "p90", "p99", "avg bytes"]
+        table = [header] + [[str(v) for v in row] for _, row in rows]
+        widths = [max(len(row[i]) for row in table) for i in range(len(header))]
+        lines = ["  ".join(v.ljust(w) if i == 0 else v.rjust(w) for i, (v, w) in enumerate(zip(row, widths)))
+                 for row in table]
+        return "\n".join(lines) + f"\n\nTimes in ms over the last {METRICS_WINDOW} runs of each item.\n"
+
+    @staticmethod
+    def metric_name(name):
+        if name in Metrics.COUNTERS:
+            return f"bpqx_{name}_total"
+        return f"bpqx_{name}" if name == "output_bytes" else f"bpqx_{name}_seconds"
+
+    def prometheus(self):
+        """All histograms and counters in the Prometheus text exposition format."""
+        lines = []
+        for name in self.HISTOGRAMS:
+            metric = self.metric_name(name)
+            lines.append(f"# TYPE {metric} histogram")
+            for label, item in self.items.items():
+                hist = item["histograms"][name]
+                item_label = prometheus_label(label)
+                total = 0
+                for bound, count in zip(hist.bounds + ("+Inf",), hist.counts):
+                    total += count
+                    lines.append(f'{metric}_bucket{{item="{item_label}",le="{bound}"}} {total}')
+                lines.append(f'{metric}_sum{{item="{item_label}"}} {hist.sum}')
+                lines.append(f'{metric}_count{{item="{item_label}"}} {hist.count}')
+        for name in self.COUNTERS:
+            metric = self.metric_name(name)
+            lines.append(f"# TYPE {metric} counter")
+            for label, item in self.items.items():
+                lines.append(f'{metric}{{item="{prometheus_label(label)}"}} {item["counters"][name]}')
+        return "\n".join(lines) + "\n"
+
+    def add_prometheus(self, text):
+        """Add the totals in text, as written by prometheus(), to these metrics.
+
+        Only bucket counts, sums and counters are restored; the recent samples
+        behind report()'s percentiles aren't in the file. Unknown lines are skipped.
+        """
+        fields = {f"{self.metric_name(name)}_{field}": (name, field)
+                  for name in self.HISTOGRAMS for field in ("bucket", "sum", "count")}
+        fields.update((self.metric_name(name), (name, "counter")) for name in self.COUNTERS)
+        cumulative = {}
+        for line in text.splitlines():
+            m = PROMETHEUS_SAMPLE.match(line)
+            if not m or m.group(1) not in fields:
+                continue
+            name, field = fields[m.group(1)]
+            label = re.sub(r"\\(.)", lambda e: "\n" if e.group(1) == "n" else e.group(1), m.group(2))
+            try:
+                value = float(m.group(4))
+            except ValueError:
+                continue
+            if not math.isfinite(value):
+                continue
+            item = self.item(label)
+            if field == "counter":
+                item["counters"][name] += int(value)
+            elif field == "sum":
+                item["histograms"][name].sum += value
+            elif field == "count":
+                item["histograms"][name].count += int(value)
+            else:
+                cumulative.setdefault((label, name), {})[m.group(3)] = int(value)
+        for (label, name), buckets in cumulative.items():
+            hist = self.items[label]["histograms"][name]
+            previous = 0
+            for i, bound in enumerate(hist.bounds + ("+Inf",)):
+                total = buckets.get(str(bound), previous)
+                hist.counts[i] += total - previous
+                previous = total
+
+
+def prometheus_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def write_metrics_file(path):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w") as f:
+            f.write(METRICS.prometheus())
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"Error writing {path}: {e}")
+
+
+def add_to_metrics_file(path):
+    """Add this process's metrics to the totals in path, for sessions that each run in their own process.
+
+    A lock file next to path keeps sessions that end at the same time from
+    losing each other's runs.
+    """
+    import fcntl
+
+    if not METRICS.items:
+        return
+    try:
+        with open(f"{path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(path, "r") as f:
+                    METRICS.add_prometheus(f.read())
+            except FileNotFoundError:
+                pass
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                f.write(METRICS.prometheus())
+            os.replace(tmp, path)
+    except OSError as e:
+        print(f"Error writing {path}: {e}", file=sys.stderr)
+
+
+METRICS = Metrics()
+
+
+# One ResponseCache per io block with a cache setting, keyed by cache_scope().
+RESPONSE_CACHES = {}
+PERSISTED_SCOPES = set()
+
+
+def cache_scope(io_obj):
+    """Identify an io block by its command or request template, which survives reloads."""
+    if isinstance(io_obj, list):
+        return repr(("pipeline", [cache_scope(step) for step in io_obj]))
+    if "http" in io_obj:
+        http = io_obj["http"]
+        return repr(("http", http.get("method", "GET"), http["url"], sorted((http.get("query") or {}).items())))
+    if "sqlite" in io_obj:
+        return repr(("sqlite", io_obj["sqlite"]["database"], io_obj["sqlite"]["query"]))
+    if "parallel" in io_obj:
+        return repr(("parallel", [cache_scope(part) for part in io_obj["parallel"]]))
+    return repr(("command", io_obj["command"]))
+
+
+def response_cache_for(io_obj):
+    settings = (io_obj[0] if isinstance(io_obj, list) else io_obj).get("cache")
+    if not settings:
+        return None
+    scope = cache_scope(io_obj)
+    cache = RESPONSE_CACHES.get(scope)
+    if cache is None:
+        cache = RESPONSE_CACHES[scope] = ResponseCache(settings.get("max_entries", RESPONSE_CACHE_DEFAULT_ENTRIES))
+        if settings.get("persist"):
+            PERSISTED_SCOPES.add(scope)
+            cache.entries.update(load_persisted_responses().get(scope, ()))
+    return cache
+
+
+def load_persisted_responses():
+    try:
+        with open(RESPONSE_CACHE_PATH, "rb") as f:
+            data = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return {}
+    if not isinstance(data, dict) or data.get("key") != CACHE_KEY:
+        return {}
+    return data.get("scopes") or {}
+
+
+def save_persisted_responses():
+    """Write the caches of io blocks with persist: true to disk, merged with what is already there."""
+    if not PERSISTED_SCOPES:
+        return
+    scopes = load_persisted_responses()
+    now = time.time()
+    for scope in PERSISTED_SCOPES:
+        scopes[scope] = [(k, v) for k, v in RESPONSE_CACHES[scope].entries.items() if v[0] >= now]
+    tmp = f"{RESPONSE_CACHE_PATH}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            marshal.dump({"key": CACHE_KEY, "scopes": scopes}, f)
+        os.replace(tmp, RESPONSE_CACHE_PATH)
+    except (OSError, ValueError):
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+
+async def run_with_abort(session, work, timeout=None):
+    """Await the coroutine work unless it outlives timeout seconds or the user aborts it.
+
+    Aborting means X, Exit or Ctrl-C while it runs. Time spent waiting at
+    the pager doesn't count towards the timeout. work is cancelled in
+    either case and is responsible for cleaning up after itself. Returns
+    work's result, or None if it was cut short.
+    """
+    task = asyncio.ensure_future(work)
+    abort = asyncio.ensure_future(wait_for_abort(session))
+    deadline = time.monotonic() + timeout if timeout else None
+    paused = session.paused_time()
+    try:
+        with session.interrupts():
+            while True:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline + session.paused_time() - paused - time.monotonic()
+                    if remaining <= 0:
+                        done = set()
+                        break
+                done, _ = await asyncio.wait({task, abort}, timeout=remaining,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if done:
+                    break
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        # Wait for the watcher to let go of the input queue before anyone prompts again.
+        abort.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await abort
+    if task in done:
+        return task.result()
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    if abort in done:
+        session.print("\nAborted.")
+    else:
+        session.print(f"\nError: timed out after {timeout:g}s")
+
+
+async def run_command(out, command, stdin=subprocess.DEVNULL, stdout=None):
+    """Run a command, streaming its stdout to out as it arrives.
+
+    command is an argument list, run directly, or a string for /bin/sh.
+    stdin and stdout may be pipe file descriptors from run_pipeline(); they
+    are closed here once the process has them, and output sent to stdout
+    doesn't reach out. stdout is read in COMMAND_CHUNK_SIZE pieces and
+    decoded incrementally, so however much a command prints, only a chunk
+    of it is held at a time. Only the last STDERR_TAIL_BYTES of stderr are
+    kept, in out.stderr. Other sessions keep running while this one waits.
+    If cancelled, the command's whole process group is killed. Returns True
+    if the command exited with status 0.
+    """
+    session = out.session
+    options = dict(
+        stdin=stdin,
+        stdout=subprocess.PIPE if stdout is None else stdout,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+    )
+    try:
+        if isinstance(command, str):
+            proc = await asyncio.create_subprocess_shell(command, **options)
+        else:
+            proc = await asyncio.create_subprocess_exec(*command, **options)
+    except Exception as e:
+        session.print(f"Error running command: {e}")
+        return False
+    finally:
+        for fd in (stdin, stdout):
+            if fd is not None and fd >= 0:
+                os.close(fd)
+    out.started = time.monotonic()
+    tail = bytearray()
+    errors = asyncio.ensure_future(read_tail(proc.stderr, tail))
+    try:
+        if proc.stdout is None:
+            await proc.wait()
+        else:
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            while True:
+                chunk = await proc.stdout.read(COMMAND_CHUNK_SIZE)
+                if not chunk:
+                    break
+                await out.write(decoder.decode(chunk))
+            await out.write(decoder.decode(b"", final=True))
+            await out.finish()
+    except StopOutput:
+        kill_process_group(proc)
+        return False
+    except asyncio.CancelledError:
+        kill_process_group(proc)
+        raise
+    finally:
+        await proc.wait()
+        out.status = proc.returncode
+        # A child left running in the background may hold stderr open; don't wait long for its EOF.
+        await asyncio.wait({errors}, timeout=0.1)
+        errors.cancel()
+        out.stderr = tail.decode("utf-8", errors="replace")
+    return proc.returncode == 0
+
+
+async def read_tail(stream, tail):
+    """Read stream to EOF, keeping only its last STDERR_TAIL_BYTES in the bytearray tail."""
+    while True:
+        chunk = await stream.read(COMMAND_CHUNK_SIZE)
+        if not chunk:
+            return
+        tail += chunk
+        del tail[:-STDERR_TAIL_BYTES]
+
+
+class PartOutput:
+    """Output of one part of a parallel io block or pipeline, queued until show_in_order() shows it.
+
+    It stands in for a CommandOutput: run_command() and run_http() write to it
+    and print their errors through out.session, which is the part itself, so
+    errors appear in order with the rest of that part's output.
+    """
+
+    def __init__(self):
+        self.session = self
+        self.queue = asyncio.Queue()
+        self.created = time.monotonic()
+        self.started = None
+        self.first_output = None
+        self.received = 0
+        self.status = None
+        self.stderr = ""
+
+    async def write(self, text):
+        if text:
+            if self.first_output is None:
+                self.first_output = time.monotonic()
+            self.received += len(text.encode("utf-8", errors="replace"))
+            self.queue.put_nowait(text)
+
+    async def finish(self):
+        pass
+
+    def print(self, *args, end="\n"):
+        self.queue.put_nowait(" ".join(str(a) for a in args) + end)
+
+
+async def run_parallel(out, works, titles, limit):
+    """Run works (see prepare_action()) at most limit at a time, showing their output in list order.
+
+    The first part streams as it arrives; later parts are queued meanwhile
+    and shown as soon as the ones before them finish, so the whole takes as
+    long as the slowest part. Returns True if every part succeeded.
+    """
+    semaphore = asyncio.Semaphore(limit)
+    parts = [PartOutput() for _ in works]
+
+    async def run(work, part):
+        try:
+            async with semaphore:
+                return await work(part)
+        finally:
+            part.queue.put_nowait(None)
+
+    tasks = [asyncio.ensure_future(run(work, part)) for work, part in zip(works, parts)]
+    try:
+        await show_in_order(out, parts, titles)
+        results = await asyncio.gather(*tasks)
+    except StopOutput:
+        return False
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    out.started = min((p.started for p in parts if p.started is not None), default=None)
+    out.status = [part.status for part in parts]
+    out.stderr = "".join(part.stderr for part in parts)[-STDERR_TAIL_BYTES:]
+    return all(results)
+
+
+async def show_in_order(out, parts, titles):
+    """Copy each PartOutput's queued output to out in list order, each until its None."""
+    for part, title in zip(parts, titles):
+        if title:
+            await out.write(f"{title}\n")
+        last = "\n"
+        while True:
+            text = await part.queue.get()
+            if text is None:
+                break
+            await out.write(text)
+            last = text
+        if not last.endswith("\n"):
+            await out.write("\n")
+    await out.finish()
+
+
+class CaptureOutput(PartOutput):
+    """Keeps a pipeline step's output for a capture placeholder or a piped http body; errors go to part."""
+
+    def __init__(self, part):
+        super().__init__()
+        self.session = part
+        self.chunks = []
+
+    async def write(self, text):
+        if text:
+            if self.first_output is None:
+                self.first_output = time.monotonic()
+            self.chunks.append(text)
+
+    def text(self):
+        return "".join(self.chunks)
+
+
+class PipeOutput(PartOutput):
+    """Streams an http or sqlite step's output into the pipe a following command reads; errors go to part."""
+
+    def __init__(self, part, fd):
+        super().__init__()
+        self.session = part
+        self.fd = fd
+
+    async def write(self, text):
+        if not text:
+            return
+        if self.first_output is None:
+            self.first_output = time.monotonic()
+        data = text.encode("utf-8", errors="replace")
+        self.received += len(data)
+        try:
+            # A blocking write on an executor thread, so a slow reader holds back the download.
+            await asyncio.get_running_loop().run_in_executor(None, write_all, self.fd, data)
+        except OSError:
+            # The reading command exited; nothing more is wanted.
+            raise StopOutput
+
+
+def write_all(fd, data):
+    while data:
+        data = data[os.write(fd, data):]
+
+
+async def run_pipeline(out, steps, values, timeout=None):
+    """Run the steps of a list-form io block, passing data along as each step asks.
+
+    A step's output goes to the placeholder named by its capture, else to
+    the next step if that one has pipe: true, else to the user. Between
+    two commands the pipe is an OS pipe, so data streams from process to
+    process without passing through Python; an http step streams into a
+    piped command, and a piped http step sends what it was given as its
+    body. Each step starts once the captures it uses are ready, so
+    independent steps overlap. Output for the user is shown in step order.
+    Returns True if every step succeeded.
+    """
+    loop = asyncio.get_running_loop()
+    values = dict(values)
+    parts = [PartOutput() for _ in steps]
+    done = [loop.create_future() for _ in steps]
+    sinks = [None] * len(steps)
+    captures = {step["capture"]: i for i, step in enumerate(steps) if step.get("capture")}
+    # pipes[i] carries step i - 1's output to step i when step i is a piped command.
+    pipes, open_fds = {}, set()
+    for i, step in enumerate(steps):
+        if step.get("pipe") and "command" in step:
+            pipes[i] = os.pipe()
+            open_fds.update(pipes[i])
+
+    def take(fd):
+        open_fds.discard(fd)
+        return fd
+
+    async def run_step(i, step):
+        part = parts[i]
+        following = steps[i + 1] if i + 1 < len(steps) else {}
+        try:
+            waits = {captures[name] for name in io_placeholders(step) if name in captures}
+            if step.get("pipe") and "http" in step:
+                waits.add(i - 1)
+            for j in sorted(waits):
+                if not await done[j]:
+                    part.print(f"Skipped: step {j + 1} failed.")
+                    return False
+            try:
+                filled = render_action(step, values)
+            except KeyError as e:
+                part.print(f"Error: no value for placeholder {{{e.args[0]}}}")
+                return False
+            stdout = None
+            if step.get("capture") or (following.get("pipe") and "http" in following):
+                sink = sinks[i] = CaptureOutput(part)
+            elif following.get("pipe") and "command" in step:
+                sink, stdout = part, take(pipes[i + 1][1])
+            elif following.get("pipe"):
+                sink = PipeOutput(part, pipes[i + 1][1])
+            else:
+                sink = part
+            if "sqlite" in step:
+                ok = await run_sqlite(sink, filled)
+            elif isinstance(filled, dict):
+                if step.get("pipe"):
+                    filled["body"] = sinks[i - 1].text().encode("utf-8")
+                ok = await run_http(sink, filled, timeout)
+            else:
+                stdin = take(pipes[i][0]) if i in pipes else subprocess.DEVNULL
+                ok = await run_command(sink, filled, stdin=stdin, stdout=stdout)
+            if step.get("capture"):
+                values[step["capture"]] = sink.text().rstrip("\n")
+            if sink is not part:
+                part.started, part.status, part.stderr = sink.started, sink.status, sink.stderr
+            return ok
+        finally:
+            # Whatever this step didn't hand to a process, close, so its neighbours see EOF.
+            for fd in (pipes.get(i, (None,))[0], pipes.get(i + 1, (None, None))[1]):
+                if fd in open_fds:
+                    os.close(take(fd))
+
+    async def run(i, step):
+        ok = False
+        try:
+            ok = await run_step(i, step)
+            return ok
+        finally:
+            # Even if this step failed or was cancelled, its dependents and the display move on.
+            done[i].set_result(ok)
+            parts[i].queue.put_nowait(None)
+
+    tasks = [asyncio.ensure_future(run(i, step)) for i, step in enumerate(steps)]
+    try:
+        await show_in_order(out, parts, [None] * len(steps))
+        results = await asyncio.gather(*tasks)
+    except StopOutput:
+        return False
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for fd in open_fds:
+            os.close(fd)
+    out.started = min((p.started for p in parts if p.started is not None), default=None)
+    out.status = [part.status for part in parts]
+    out.stderr = "".join(part.stderr for part in parts)[-STDERR_TAIL_BYTES:]
+    return all(results)
+
+
+class HTTPPool:
+    """Idle keep-alive connections per (scheme, host, port), shared by every session.
+
+    http.client is blocking, so requests run on the pool's own executor
+    threads (see run()); the lock guards the idle lists between them.
+    """
+
+    def __init__(self, max_idle=4):
+        self.max_idle = max_idle
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def get(self, key, timeout):
+        with self.lock:
+            conns = self.idle.get(key)
+            if conns:
+                conn = conns.pop()
+                conn.timeout = timeout
+                if conn.sock:
+                    conn.sock.settimeout(timeout)
+                return conn, True
+        import http.client
+
+        scheme, host, port = key
+        cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        conn = cls(host, port, timeout=timeout)
+        # Connect through connect_socket() so conn.sock is there to shut down while connecting.
+        conn._create_connection = functools.partial(connect_socket, conn)
+        return conn, False
+
+    def put(self, key, conn):
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.max_idle:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def run(self, func, *args):
+        """Call func(*args) on an HTTP thread; returns an awaitable for its result."""
+        if self.executor is None:
+            import concurrent.futures
+
+            self.executor = concurrent.futures.ThreadPoolExecutor(thread_name_prefix="bpqx-http")
+        return asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def shutdown(self):
+        """Drop requests still queued for a thread and let the threads exit when idle."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+def connect_socket(conn, address, timeout, source_address=None):
+    """socket.create_connection() that stores each socket in conn.sock before connecting it.
+
+    A cancelled run_http() shuts conn.sock down, which wakes a connect()
+    blocked here, and closes conn, which stops the remaining addresses
+    being tried.
+    """
+    import socket
+
+    host, port = address
+    error = OSError(f"getaddrinfo returned no addresses for {host}")
+    for family, type_, proto, _, addr in socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+        sock = socket.socket(family, type_, proto)
+        conn.sock = sock
+        try:
+            sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(addr)
+            return sock
+        except OSError as e:
+            error = e
+            sock.close()
+            if conn.sock is not sock:
+                break
+            conn.sock = None
+    raise error
+
+
+HTTP_POOL = HTTPPool()
+
+
+def compile_http(http):
+    """Compile every field of an http block that may hold placeholders (see compile_template())."""
+    return {
+        "method": (http.get("method") or "GET").upper(),
+        "url": compile_template(http["url"]),
+        "query": [[k, compile_template(str(v))] for k, v in (http.get("query") or {}).items()],
+        "headers": [[k, compile_template(str(v))] for k, v in (http.get("headers") or {}).items()],
+        "body": compile_template(http["body"]) if http.get("body") is not None else None,
+    }
+
+
+def build_http_request(http, values):
+    """Fill a compiled http block (see compile_http()) with input values. Raises KeyError like render_template().
+
+    Values in the URL are percent-encoded, so one can't add a path segment,
+    query or fragment. Body and header values are inserted as given.
+    """
+    import urllib.parse
+
+    url = render_template(http["url"], {name: urllib.parse.quote(values[name], safe="") for name in http["url"][1::2]})
+    query = [(k, render_template(v, values)) for k, v in http["query"]]
+    if query:
+        url += ("&" if "?" in url else "?") + urllib.parse.urlencode(query)
+    body = render_template(http["body"], values) if http["body"] is not None else None
+    return {
+        "method": http["method"],
+        "url": url,
+        "headers": {k: render_template(v, values) for k, v in http["headers"]},
+        "body": body.encode("utf-8") if body is not None else None,
+    }
+
+
+def send_http(conn, request, path):
+    """Send request on conn and wait for the response headers (blocking)."""
+    conn.request(request["method"], path, body=request["body"], headers=request["headers"])
+    return conn.getresponse()
+
+
+async def run_http(out, request, timeout=None):
+    """Make an HTTP request in-process and stream the response body to out.
+
+    Returns True if the server answered with a non-error status.
+    """
+    import http.client
+    import socket
+    import urllib.parse
+
+    session = out.session
+    parts = urllib.parse.urlsplit(request["url"])
+    key = (parts.scheme, parts.hostname, parts.port)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    conn = None
+    try:
+        while True:
+            # Taken here rather than on the HTTP thread, so a cancel below
+            # always has the connection whose socket it must shut down.
+            conn, reused = HTTP_POOL.get(key, timeout or None)
+            try:
+                resp = await HTTP_POOL.run(send_http, conn, request, path)
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                # The server dropped an idle keep-alive connection; retry once on a fresh one.
+                if not reused:
+                    raise
+        out.started = time.monotonic()
+        out.status = resp.status
+        if resp.status >= 400:
+            session.print(f"Error: HTTP {resp.status} {resp.reason}")
+            conn.close()
+            return False
+        charset = resp.headers.get_content_charset() or "utf-8"
+        decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+        while True:
+            chunk = await HTTP_POOL.run(resp.read1, HTTP_CHUNK_SIZE)
+            if not chunk:
+                break
+            await out.write(decoder.decode(chunk))
+        await out.write(decoder.decode(b"", final=True))
+        await out.finish()
+        # read1() doesn't mark a Content-Length response finished; read() does, freeing the connection.
+        await HTTP_POOL.run(resp.read)
+        if resp.will_close:
+            conn.close()
+        else:
+            HTTP_POOL.put(key, conn)
+        return True
+    except StopOutput:
+        conn.close()
+        return False
+    except asyncio.CancelledError:
+        if conn is not None:
+            # Wake the HTTP thread if it is still connecting, sending or reading on this connection.
+            if conn.sock:
+                try:
+                    conn.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            conn.close()
+        raise
+    except (OSError, http.client.HTTPException, LookupError) as e:
+        if conn is not None:
+            conn.close()
+        session.print(f"Error: HTTP request to {request['url']} failed: {e}")
+        return False
+
+
+def compile_sqlite(sqlite):
+    """Compile a sqlite block: the query's placeholders become ? parameters, bound by name on each run.
+
+    The database path is relative to bpqx.py. row, header and empty are
+    compiled with compile_template(); row's placeholders are column names.
+    """
+    parts = PLACEHOLDER.split(sqlite["query"])
+    return {
+        "database": os.path.join(SCRIPT_DIR, sqlite["database"]),
+        "sql": "?".join(parts[0::2]),
+        "params": parts[1::2],
+        "row": compile_template(sqlite["row"]) if sqlite.get("row") is not None else None,
+        "header": compile_template(sqlite["header"]) if sqlite.get("header") else None,
+        "empty": compile_template(sqlite["empty"]) if sqlite.get("empty") else None,
+    }
+
+
+def build_sqlite_query(sqlite, values):
+    """Fill a compiled sqlite block with input values. Raises KeyError like render_template()."""
+    return {
+        "database": sqlite["database"],
+        "sql": sqlite["sql"],
+        "params": [values[name] for name in sqlite["params"]],
+        "row": sqlite["row"],
+        "header": render_template(sqlite["header"], values) if sqlite["header"] else None,
+        "empty": render_template(sqlite["empty"], values) if sqlite["empty"] else None,
+    }
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance, for sqlite queries. Arguments may be numbers or numeric text; NULL if any isn't."""
+    try:
+        lat1, lng1, lat2, lng2 = (math.radians(float(v)) for v in (lat1, lng1, lat2, lng2))
+    except (TypeError, ValueError):
+        return None
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(h)))
+
+
+def distance_miles(lat1, lng1, lat2, lng2):
+    km = distance_km(lat1, lng1, lat2, lng2)
+    return None if km is None else km / KM_PER_MILE
+
+
+def lng_span(miles, lat):
+    """Degrees of longitude that miles covers at latitude lat, for R-tree bounding boxes."""
+    try:
+        # Clamped near the poles, where a box would otherwise span every longitude anyway.
+        return float(miles) / (MILES_PER_DEGREE * max(math.cos(math.radians(float(lat))), 0.01))
+    except (TypeError, ValueError):
+        return None
+
+
+def lat_span(miles):
+    """Degrees of latitude that miles covers."""
+    try:
+        return float(miles) / MILES_PER_DEGREE
+    except (TypeError, ValueError):
+        return None
+
+
+# SQL functions every sqlite query can call: name -> (number of arguments, function).
+SQLITE_FUNCTIONS = {
+    "distance_km": (4, distance_km),
+    "distance_miles": (4, distance_miles),
+    "lat_span": (1, lat_span),
+    "lng_span": (2, lng_span),
+}
+
+
+def open_sqlite(database):
+    """Open database read-only (blocking), with SQLITE_FUNCTIONS registered."""
+    import sqlite3
+    import urllib.parse
+
+    conn = sqlite3.connect(f"file:{urllib.parse.quote(database)}?mode=ro", uri=True, check_same_thread=False)
+    for name, (nargs, func) in SQLITE_FUNCTIONS.items():
+        conn.create_function(name, nargs, func, deterministic=True)
+    return conn
+
+
+def format_row(template, columns, row):
+    values = ["" if v is None else str(v) for v in row]
+    if template is None:
+        return " ".join(values)
+    return render_template(template, dict(zip(columns, values)))
+
+
+async def run_sqlite(out, query):
+    """Run a query against a local SQLite database and write one line per result row to out.
+
+    Rows are fetched SQLITE_FETCH_ROWS at a time on an executor thread, so
+    other sessions keep running and a large result streams like command
+    output. Returns True if the query ran.
+    """
+    import sqlite3
+
+    session = out.session
+    loop = asyncio.get_running_loop()
+    conn = None
+    try:
+        conn = await loop.run_in_executor(None, open_sqlite, query["database"])
+        cursor = await loop.run_in_executor(None, conn.execute, query["sql"], query["params"])
+        out.started = time.monotonic()
+        columns = [d[0] for d in cursor.description or []]
+        count = 0
+        while True:
+            rows = await loop.run_in_executor(None, cursor.fetchmany, SQLITE_FETCH_ROWS)
+            if not rows:
+                break
+            if not count and query["header"]:
+                await out.write(query["header"] + "\n")
+            count += len(rows)
+            await out.write("".join(format_row(query["row"], columns, row) + "\n" for row in rows))
+        if not count and query["empty"]:
+            await out.write(query["empty"] + "\n")
+        await out.finish()
+        out.status = 0
+        return True
+    except StopOutput:
+        return False
+    except asyncio.CancelledError:
+        if conn is not None:
+            # Stop a query still running on an executor thread.
+            conn.interrupt()
+        raise
+    except KeyError as e:
+        session.print(f"Error: the query has no column {{{e.args[0]}}} for its row template")
+        return False
+    except sqlite3.Error as e:
+        session.print(f"Error: query on {os.path.basename(query['database'])} failed: {e}")
+        return False
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+async def wait_for_abort(session):
+    """Return when the user aborts the running command; keep any other typed-ahead lines.
+
+    Lines that were already queued before the command started are type-ahead
+    for later prompts, not an abort.
+    """
+    for _ in range(session.lines.qsize()):
+        line = session.lines.get_nowait()
+        if line != INTERRUPT:
+            session.pending.append(line)
+    session.watching = True
+    try:
+        while True:
+            line = await session.lines.get()
+            if session.reply is not None and not session.reply.done():
+                # The command itself is prompting (e.g. the pager); the line is its answer.
+                session.reply.set_result(line)
+                continue
+            if line is None:
+                session.pending.append(None)
+                return
+            if line == INTERRUPT or line.strip().lower() in ("x", "exit"):
+                return
+            session.pending.append(line)
+    finally:
+        session.watching = False
+
+
+def kill_process_group(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def display_menu(session, menu):
+    session.print(menu["_display"])
+
+
+async def run_extension(session, ext):
+    errors = load_extension_body(ext, session.appsettings.get("menu_width") or 0)
+    if errors:
+        for err in errors:
+            session.print(err)
+        session.print(f"{ext['name']} is unavailable.")
+        return
+
+    session.trace("extension", extension=ext["name"])
+    start_msg = ext["program"].get("start_msg", "")
+    if start_msg:
+        session.print(start_msg)
+
+    menu_stack = [ext["program"]["menu"]]
+    # Item texts leading to each menu on the stack, for metrics labels.
+    path_stack = [ext["name"]]
+
+    while True:
+        current_menu = menu_stack[-1]
+        display_menu(session, current_menu)
+
+        user_input = (await session.input("> ")).strip()
+        if not user_input:
+            continue
+
+        lower = user_input.lower()
+
+        if lower in ("x", "exit"):
+            raise SessionExit
+
+        if lower in ("b", "back"):
+            if len(menu_stack) > 1:
+                menu_stack.pop()
+                path_stack.pop()
+            else:
+                return
+            continue
+
+        if lower in ("h", "help"):
+            if len(menu_stack) == 1:
+                session.print(ext.get("help", "No help available."))
+            else:
+                session.print(current_menu.get("help", ext.get("help", "No help available.")))
+            continue
+
+        if lower in ("a", "about"):
+            if len(menu_stack) == 1:
+                session.print(ext.get("about", "No about information available."))
+            else:
+                session.print(current_menu.get("about", ext.get("about", "No about information available.")))
+            continue
+
+        parts = lower.split(None, 1)
+        if len(parts) == 2 and parts[0] in ("h", "help"):
+            item = find_item_by_text(current_menu, parts[1])
+            if item:
+                session.print(item.get("help", "No help available."))
+            else:
+                session.print(f"Unknown item: {parts[1]}")
+            continue
+
+        if len(parts) == 2 and parts[0] in ("a", "about"):
+            item = find_item_by_text(current_menu, parts[1])
+            if item:
+                session.print(item.get("about", "No about information available."))
+            else:
+                session.print(f"Unknown item: {parts[1]}")
+            continue
+
+        item, inline = find_item_by_input(current_menu, user_input)
+        if not item:
+            parts = user_input.split(None, 1)
+            matches = find_items_by_prefix(current_menu, parts[0].lower(), parts[1] if len(parts) == 2 else None)
+            if len(matches) > 1:
+                names = ", ".join(strip_inline_param(current_menu["items"][i]["text"]) for i, _ in matches)
+                session.print(f"Options: {names}")
+            continue
+
+        if "menu" in item:
+            menu_stack.append(item["menu"])
+            path_stack.append(strip_inline_param(item["text"]))
+            session.trace("menu", path="/".join(path_stack))
+        elif "io" in item:
+            io_obj = item["io"]
+            precollected = None
+            if inline:
+                param_name, param_value = inline
+                precollected = {param_name: param_value}
+            label = "/".join(path_stack + [strip_inline_param(item["text"])])
+            await run_io(session, io_obj, precollected=precollected, label=label)
+
+
+def menu_header(extensions):
+    names = ", ".join(ext["name"] for ext in extensions.values())
+    return f"\n- BPQX -\n[A]About [H]Help [B]Back [X]Exit\n\nSelect Extension: {names}"
+
+
+async def main_menu(session, appsettings, registry, shown=False):
+    """Run the top-level menu. shown means the first menu and prompt were already written."""
+    extensions = None
+    while True:
+        # Pick up a reloaded set of extensions each time we're back here.
+        if registry.extensions is not extensions:
+            extensions = registry.extensions
+            ext_trie = build_trie((k, k) for k in extensions)
+            header = menu_header(extensions)
+        if shown:
+            shown = False
+            prompt = ""
+        else:
+            session.print(header)
+            prompt = "> "
+        user_input = (await session.input(prompt)).strip()
+        if not user_input:
+            continue
+
+        lower = user_input.lower()
+
+        if lower in ("x", "exit"):
+            raise SessionExit
+
+        if lower in ("h", "help"):
+            session.print(appsettings.get("help", "No help available."))
+            continue
+
+        if lower in ("a", "about"):
+            session.print(appsettings.get("about", "No about information available."))
+            continue
+
+        parts = lower.split(None, 1)
+        if len(parts) == 2 and parts[0] in ("h", "help"):
+            ext = extensions.get(parts[1])
+            if ext:
+                session.print(ext.get("help", "No help available."))
+            else:
+                session.print(f"Unknown extension: {parts[1]}")
+            continue
+
+        if len(parts) == 2 and parts[0] in ("a", "about"):
+            ext = extensions.get(parts[1])
+            if ext:
+                session.print(ext.get("about", "No about information available."))
+            else:
+                session.print(f"Unknown extension: {parts[1]}")
+            continue
+
+        ext = extensions.get(lower)
+        if ext:
+            await run_extension(session, ext)
+        else:
+            matches = trie_lookup(ext_trie, lower)
+            if len(matches) == 1:
+                await run_extension(session, extensions[matches[0]])
+            elif len(matches) > 1:
+                names = ", ".join(extensions[k]["name"] for k in matches)
+                session.print(f"Options: {names}")
+            else:
+                session.print(f"\nSelect Extension: {', '.join(ext['name'] for ext in extensions.values())}")
+
+
+
+async def run_session(session, appsettings, registry, shown=False):
+    """Run one user's session from the main menu until they exit or disconnect."""
+    session.appsettings = appsettings
+    started = time.monotonic()
+    session.trace("connect", callsign=session.callsign)
+    try:
+        await main_menu(session, appsettings, registry, shown)
+    except SessionExit:
+        pass
+    finally:
+        session.trace("disconnect", duration=round(time.monotonic() - started, 3))
+        save_persisted_responses()
+        await session.close()
+
+
+async def run_stdio(appsettings, registry, shown=False):
+    await run_session(StdioSession(), appsettings, registry, shown)
+
+
+# inotify(7) constants; the events that mean a file in the directory was
+# written, renamed into place or removed.
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_DELETE = 0x200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+# Seconds between directory scans when inotify isn't available.
+RELOAD_POLL_INTERVAL = 2.0
+
+
+def inotify_open(directory):
+    """Return a non-blocking inotify fd watching directory, or None if inotify isn't available."""
+    import ctypes
+
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+    if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def read_inotify_names(fd):
+    """Drain the inotify fd and return the set of file names that had events."""
+    names = set()
+    while True:
+        try:
+            data = os.read(fd, 65536)
+        except BlockingIOError:
+            return names
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            names.add(os.fsdecode(data[offset:offset + length].rstrip(b"\0")))
+            offset += length
+
+
+def extension_stamps():
+    stamps = {}
+    for filepath in glob.glob(os.path.join(EXTENSIONS_DIR, "*.yml")):
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            continue
+        stamps[filepath] = (st.st_mtime_ns, st.st_size)
+    return stamps
+
+
+async def watch_extensions(registry):
+    """Reload extension files as they change, using inotify where available and polling otherwise."""
+    fd = inotify_open(EXTENSIONS_DIR)
+    if fd is None:
+        stamps = extension_stamps()
+        while True:
+            await asyncio.sleep(RELOAD_POLL_INTERVAL)
+            current = extension_stamps()
+            for filepath in sorted(set(stamps) | set(current)):
+                if stamps.get(filepath) != current.get(filepath):
+                    registry.reload(filepath)
+            stamps = current
+
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    loop.add_reader(fd, ready.set)
+    try:
+        while True:
+            await ready.wait()
+            # Let an editor finish its burst of writes and renames first.
+            await asyncio.sleep(0.1)
+            ready.clear()
+            for name in sorted(read_inotify_names(fd)):
+                if name.endswith(".yml"):
+                    registry.reload(os.path.join(EXTENSIONS_DIR, name))
+    finally:
+        loop.remove_reader(fd)
+        os.close(fd)
+
+
+def parse_address(address):
+    """Split a --serve address into ('unix', path) or ('tcp', (host, port))."""
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return "tcp", (host or "127.0.0.1", int(port))
+
+
+async def serve_admin(path):
+    """Answer every connection to the Unix socket at path with the metrics report."""
+    async def handle(reader, writer):
+        writer.write(METRICS.report().encode())
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)
+    return await asyncio.start_unix_server(handle, path=path)
+
+
+async def write_metrics_periodically(path):
+    try:
+        while True:
+            await asyncio.sleep(METRICS_FILE_INTERVAL)
+            write_metrics_file(path)
+    finally:
+        write_metrics_file(path)
+
+
+def print_stats(path):
+    """Print the report from a running server's admin socket."""
+    import socket
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    sys.stdout.write(b"".join(chunks).decode())
+
+
+async def serve(address, appsettings, registry, callsign=False, admin=None, metrics_file=None):
+    async def handle(reader, writer):
+        session = StreamSession(reader, writer)
+        if callsign:
+            try:
+                session.callsign = (await session.input()).strip().upper()
+            except SessionExit:
+                await session.close()
+                return
+        await run_session(session, appsettings, registry)
+
+    kind, where = parse_address(address)
+    if kind == "unix":
+        server = await asyncio.start_unix_server(handle, path=where)
+    else:
+        server = await asyncio.start_server(handle, host=where[0], port=where[1])
+    print(f"BPQX listening on {address}")
+    tasks = [asyncio.create_task(watch_extensions(registry))]
+    if metrics_file:
+        tasks.append(asyncio.create_task(write_metrics_periodically(metrics_file)))
+    admin_server = await serve_admin(admin) if admin else None
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if admin_server:
+            admin_server.close()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def pool_worker(listener, notify, appsettings, registry, metrics_file=None):
+    """Wait for one launcher connection, take over its stdin/stdout and run a session on them."""
+    import socket
+
+    conn, _ = listener.accept()
+    listener.close()
+    os.write(notify, struct.pack("i", os.getpid()))
+    os.close(notify)
+    # Leave the pool's process group so stopping the pool doesn't cut off users.
+    os.setsid()
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    _, fds, _, _ = socket.recv_fds(conn, 16, 2)
+    if len(fds) != 2:
+        return
+    os.dup2(fds[0], 0)
+    os.dup2(fds[1], 1)
+    for fd in fds:
+        os.close(fd)
+    # The launcher forwards Ctrl-C to this pid and exits when conn closes with us.
+    conn.sendall(struct.pack("i", os.getpid()))
+    try:
+        asyncio.run(run_stdio(appsettings, registry))
+    except KeyboardInterrupt:
+        pass
+    HTTP_POOL.shutdown()
+    stop_trace()
+    sys.stdout.flush()
+    if metrics_file:
+        add_to_metrics_file(metrics_file)
+
+
+def spawn_pool_worker(listener, notify, appsettings, registry, metrics_file=None):
+    # A child inherits unflushed buffers and would write the pool's status
+    # lines to the connection it is given.
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid:
+        return pid
+    code = 0
+    try:
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        pool_worker(listener, notify, appsettings, registry, metrics_file)
+    except BaseException:
+        sys.excepthook(*sys.exc_info())
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def run_pool(path, workers, appsettings, registry, metrics_file=None):
+    """Keep `workers` idle forked sessions waiting on a Unix socket for bpqx_launch.py.
+
+    Everything a session needs (settings, extension headers and bodies, PyYAML)
+    is loaded here once, so a forked worker answers with no startup cost. A
+    worker that takes a connection is replaced straight away; extension files
+    are re-checked before each fork so new workers see edits.
+    """
+    import select
+    import socket
+
+    # Import PyYAML, asyncio (see lazy_import()) and what sessions import on
+    # first use now, so a worker never has to.
+    load_yaml_text("")
+    asyncio.get_event_loop_policy()
+    for name in ("datetime", "http.client", "json", "queue", "sqlite3", "urllib.parse"):
+        importlib.import_module(name)
+
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(64)
+    notify_r, notify_w = os.pipe()
+    print(f"BPQX worker pool ({workers}) listening on {path}")
+
+    stamps = extension_stamps()
+    idle = set()
+    while True:
+        if len(idle) < workers:
+            current = extension_stamps()
+            for filepath in sorted(set(stamps) | set(current)):
+                if stamps.get(filepath) != current.get(filepath):
+                    registry.reload(filepath)
+            stamps = current
+            for ext in registry.extensions.values():
+                load_extension_body(ext, registry.menu_width)
+        while len(idle) < workers:
+            idle.add(spawn_pool_worker(listener, notify_w, appsettings, registry, metrics_file))
+        ready, _, _ = select.select([notify_r], [], [], 1.0)
+        if ready:
+            data = os.read(notify_r, 4096)
+            for (pid,) in struct.iter_unpack("i", data):
+                idle.discard(pid)
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if not pid:
+                break
+            idle.discard(pid)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="BPQX CLI extension runner")
+    parser.add_argument("--serve", metavar="ADDRESS",
+                        help="run as a persistent server on HOST:PORT, PORT or unix:PATH instead of stdin/stdout")
+    parser.add_argument("--callsign", action="store_true",
+                        help="in server mode, read the caller's callsign as the first line (LinBPQ HOST ports without NOCALL)")
+    parser.add_argument("--pool", metavar="PATH", nargs="?", const=POOL_SOCKET_PATH,
+                        help="keep pre-forked sessions waiting for bpqx_launch.py on a Unix socket "
+                             "(default .bpqx-pool.sock next to this script)")
+    parser.add_argument("--workers", type=int, default=4, metavar="N",
+                        help="idle workers to keep ready with --pool (default 4)")
+    parser.add_argument("--admin", metavar="PATH",
+                        help="in server mode, serve command metrics to anyone connecting to this Unix socket")
+    parser.add_argument("--metrics-file", metavar="PATH",
+                        help="keep command metrics in this file in Prometheus text format (a server rewrites it; "
+                             "other sessions add their runs to it as they end)")
+    parser.add_argument("--stats", metavar="PATH",
+                        help="print the command metrics of a server started with --admin PATH, then exit")
+    args = parser.parse_args()
+
+    if args.stats:
+        try:
+            print_stats(args.stats)
+        except OSError as e:
+            sys.exit(f"Error reading {args.stats}: {e}")
+        return
+    if args.admin and not args.serve:
+        parser.error("--admin needs --serve")
+
+    cache = LoadCache()
+    appsettings = load_appsettings(cache)
+    registry = ExtensionRegistry(cache, appsettings)
+    cache.save()
+    start_trace(appsettings)
+
+    if not registry.extensions:
+        print("No valid extensions found.")
+        sys.exit(1)
+
+    if args.pool:
+        try:
+            run_pool(args.pool, max(1, args.workers), appsettings, registry, args.metrics_file)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    try:
+        if args.serve:
+            asyncio.run(serve(args.serve, appsettings, registry, callsign=args.callsign,
+                              admin=args.admin, metrics_file=args.metrics_file))
+        else:
+            # The first use of asyncio loads it (see lazy_import()); show the
+            # menu before that so the user is reading it in the meantime.
+            sys.stdout.write(menu_header(registry.extensions) + "\n> ")
+            sys.stdout.flush()
+            asyncio.run(run_stdio(appsettings, registry, shown=True))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        HTTP_POOL.shutdown()
+        stop_trace()
+        if args.metrics_file and not args.serve:
+            sys.stdout.flush()
+            add_to_metrics_file(args.metrics_file)
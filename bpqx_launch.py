@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Hand this connection's stdin/stdout to a pre-forked bpqx.py worker.
+
+Start the pool with `bpqx.py --pool [PATH]` and have BPQ run this script in
+place of bpqx.py. It only imports what it needs to pass the file descriptors
+on, then waits until the worker's session ends. If no pool is running it
+starts bpqx.py directly.
+"""
+
+import os
+import signal
+import socket
+import struct
+import sys
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+POOL_SOCKET_PATH = os.path.join(SCRIPT_DIR, ".bpqx-pool.sock")
+
+
+def recv_exact(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("worker closed the connection")
+        data += chunk
+    return data
+
+
+def forward_interrupt(pid):
+    def handler(signum, frame):
+        try:
+            os.kill(pid, signal.SIGINT)
+        except ProcessLookupError:
+            pass
+    return handler
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else POOL_SOCKET_PATH
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        socket.send_fds(sock, [b"bpqx"], [0, 1])
+        (pid,) = struct.unpack("i", recv_exact(sock, 4))
+    except OSError:
+        sock.close()
+        script = os.path.join(SCRIPT_DIR, "bpqx.py")
+        os.execv(sys.executable, [sys.executable, script])
+
+    signal.signal(signal.SIGINT, forward_interrupt(pid))
+    try:
+        while sock.recv(64):
+            pass
+    except OSError:
+        pass
+
+
+if __name__ == "__main__":
+    main()
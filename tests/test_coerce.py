@@ -0,0 +1,42 @@
+"""Input types that turn what a user typed into a canonical value (see INPUT_TYPES)."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bpqx_core import coerce_lat, coerce_long, coerce_regex  # noqa: E402
+
+
+class CoerceDegreesTest(unittest.TestCase):
+    def test_sign_or_hemisphere(self):
+        self.assertEqual(coerce_lat("41.7", {}), coerce_lat("41.7N", {}))
+        self.assertEqual(coerce_lat("-41.7", {}), coerce_lat("41.7s", {}))
+        self.assertEqual(coerce_long("-72.7", {}), coerce_long("72.7W", {}))
+
+    def test_sign_and_hemisphere_together(self):
+        for text in ("-41.7S", "-41.7N", "+41.7N", " -41.7S"):
+            with self.assertRaises(ValueError):
+                coerce_lat(text, {})
+        with self.assertRaises(ValueError):
+            coerce_long("-72.7W", {})
+
+    def test_out_of_range(self):
+        with self.assertRaises(ValueError):
+            coerce_lat("91N", {})
+        with self.assertRaises(ValueError):
+            coerce_long("-180.5", {})
+
+
+class CoerceRegexTest(unittest.TestCase):
+    def test_whole_value_must_match(self):
+        inp = {"pattern": "[A-Z]{2}[0-9]{2}"}
+        self.assertEqual(coerce_regex("FN43", inp), "FN43")
+        with self.assertRaises(ValueError):
+            coerce_regex("FN43x", inp)
+        self.assertEqual(coerce_regex("AB12", inp), "AB12")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+"""build_http_request() fills an http block without letting a value change the URL's shape."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bpqx_core import build_http_request, compile_http  # noqa: E402
+
+
+def build(http, **values):
+    return build_http_request(compile_http(http), values)
+
+
+class BuildHttpRequestTest(unittest.TestCase):
+    def test_url_values_are_percent_encoded(self):
+        request = build({"url": "http://host/api/get/{article}"}, article="../admin?x=1#top")
+        self.assertEqual(request["url"], "http://host/api/get/..%2Fadmin%3Fx%3D1%23top")
+
+    def test_url_value_in_query_string(self):
+        request = build({"url": "http://host/find?q={q}&n=5"}, q="a&b c")
+        self.assertEqual(request["url"], "http://host/find?q=a%26b%20c&n=5")
+
+    def test_query_is_appended(self):
+        request = build({"url": "http://host/search", "query": {"q": "{q}", "n": 5}}, q="a&b")
+        self.assertEqual(request["url"], "http://host/search?q=a%26b&n=5")
+        request = build({"url": "http://host/search?lang=en", "query": {"q": "{q}"}}, q="x")
+        self.assertEqual(request["url"], "http://host/search?lang=en&q=x")
+
+    def test_body_and_headers_are_inserted_as_given(self):
+        request = build({"url": "http://host/", "method": "post", "body": "call={call}",
+                         "headers": {"X-Call": "{call}"}}, call="N0 CALL&x")
+        self.assertEqual(request["method"], "POST")
+        self.assertEqual(request["body"], b"call=N0 CALL&x")
+        self.assertEqual(request["headers"], {"X-Call": "N0 CALL&x"})
+
+    def test_missing_value(self):
+        with self.assertRaises(KeyError):
+            build({"url": "http://host/{a}"})
+
+
+if __name__ == "__main__":
+    unittest.main()
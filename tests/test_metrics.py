@@ -0,0 +1,52 @@
+"""Metrics written by prometheus() can be read back and added to, as --metrics-file does per session."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bpqx_core import Metrics  # noqa: E402
+
+
+def sample(label, seconds, size, ok=True):
+    metrics = Metrics()
+    metrics.count(label, "runs")
+    if not ok:
+        metrics.count(label, "failures")
+    metrics.observe(label, "command", seconds)
+    metrics.observe(label, "output_bytes", size)
+    return metrics
+
+
+class AddPrometheusTest(unittest.TestCase):
+    def test_round_trip(self):
+        label = 'EXT/Menu "x"\\y'
+        text = sample(label, 0.2, 500).prometheus()
+        metrics = Metrics()
+        metrics.add_prometheus(text)
+        self.assertEqual(metrics.prometheus(), text)
+
+    def test_totals_add_up(self):
+        metrics = sample("A/B", 0.003, 50)
+        metrics.add_prometheus(sample("A/B", 7.0, 5000, ok=False).prometheus())
+        metrics.add_prometheus(sample("C/D", 0.2, 500).prometheus())
+        item = metrics.items["A/B"]
+        self.assertEqual(item["counters"]["runs"], 2)
+        self.assertEqual(item["counters"]["failures"], 1)
+        command = item["histograms"]["command"]
+        self.assertEqual(command.count, 2)
+        self.assertAlmostEqual(command.sum, 7.003)
+        self.assertEqual(sum(command.counts), 2)
+        self.assertEqual(command.counts[0], 1)
+        self.assertEqual(command.counts[command.bounds.index(10.0)], 1)
+        self.assertEqual(metrics.items["C/D"]["counters"]["runs"], 1)
+
+    def test_unknown_lines_are_skipped(self):
+        metrics = Metrics()
+        metrics.add_prometheus('# HELP x\nother_metric{item="A"} 3\nbpqx_runs_total{item="A"} nan?\nbpqx_runs_total{item="A"} NaN\n')
+        self.assertEqual(metrics.items, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
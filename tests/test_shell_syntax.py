@@ -0,0 +1,78 @@
+"""find_shell_syntax() decides which commands may run without /bin/sh.
+
+Commands run directly unless they set shell: true, so anything sh would
+have read differently from a plain argument list must be caught here;
+otherwise an existing extension changes meaning without an error.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bpqx_core import find_shell_syntax  # noqa: E402
+
+
+class FindShellSyntaxTest(unittest.TestCase):
+    def assertShell(self, command, syntax):
+        self.assertEqual(find_shell_syntax(command), syntax, command)
+
+    def assertPlain(self, command):
+        self.assertIsNone(find_shell_syntax(command), command)
+
+    def test_plain_commands(self):
+        for command in ("ls -l /tmp", "grep -i {search} file.txt", "echo {g.lat} {_grid.lng}",
+                        "find . -name {name} -exec rm {} \\;", "git show HEAD~1", "echo a,b c#d x=1"):
+            self.assertPlain(command)
+
+    def test_operators_and_redirection(self):
+        for ch, command in (("|", "ls | wc"), ("&", "a && b"), (";", "a; b"), (">", "echo x > f"),
+                            ("<", "wc < f"), ("(", "(cd /tmp)"), ("$", "echo $HOME"), ("`", "echo `date`")):
+            self.assertShell(command, ch)
+
+    def test_quoted_syntax_is_plain(self):
+        for command in ("echo 'a | b; c > d'", 'echo "a | b"', "echo \\| \\*", "echo '*' \"?\" '~' '#'",
+                        "awk '{print $1}'", "echo 'line one\nline two'"):
+            self.assertPlain(command)
+
+    def test_expansion_inside_double_quotes(self):
+        self.assertShell('echo "$HOME"', "$")
+        self.assertShell('echo "`date`"', "`")
+
+    def test_globs(self):
+        self.assertShell("ls *.txt", "*")
+        self.assertShell("ls file?", "?")
+        self.assertShell("ls [ab]", "[")
+
+    def test_tilde_only_at_word_start(self):
+        self.assertShell("ls ~/x", "~")
+        self.assertShell("~/bin/tool", "~")
+        self.assertPlain("git show HEAD~1")
+
+    def test_brace_expansion_but_not_placeholders(self):
+        self.assertShell("echo {a,b}", "{")
+        self.assertShell("echo x{1..3}", "{")
+        self.assertPlain("echo {name} {1} {}")
+
+    def test_line_breaks(self):
+        self.assertShell("echo first\necho second", "\n")
+        self.assertShell("echo first \\\n  second", "\\\n")
+        # A YAML block scalar leaves a trailing line break; that isn't a second command.
+        self.assertPlain("echo first\n")
+        self.assertPlain("echo first\n\n")
+
+    def test_comments_only_at_word_start(self):
+        self.assertShell("echo visible # hidden", "#")
+        self.assertShell("# nothing", "#")
+        self.assertPlain("echo issue#12")
+
+    def test_leading_environment_setting(self):
+        self.assertShell("LANG=C sort file", "LANG=")
+        self.assertShell("  _X1=2 tool", "_X1=")
+        self.assertPlain("tool LANG=C")
+        self.assertPlain("tool --opt=1")
+
+
+if __name__ == "__main__":
+    unittest.main()